@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Compare string fuzzy_replace with TokenChunk.replace on the main.py regression set.
+
+Every chunk is fed the words of its expected attributes followed by its own tokens
+in reverse order, the same kind of term stream lookup_attributes produces. Both
+implementations must leave the same tokens behind.
+"""
+import timeit
+
+from data import REGRESSION_SET
+from lookup_attributes.normalize import remove_stopwords
+from lookup_attributes.search import fuzzy_replace
+from lookup_attributes.token_chunk import TokenChunk, REPLACED
+
+
+def term_streams():
+    streams = []
+    for chunk, expected in REGRESSION_SET:
+        chunk = remove_stopwords(chunk)
+        words = [w for attr in expected for w in attr.split()]
+        streams.append((chunk, words + chunk.split()[::-1]))
+    return streams
+
+
+def run_string(streams):
+    left = []
+    for chunk, words in streams:
+        for word in words:
+            chunk = fuzzy_replace(word, REPLACED, chunk)
+        left.append([t for t in chunk.split() if t != REPLACED])
+    return left
+
+
+def run_tokens(streams):
+    left = []
+    for chunk, words in streams:
+        token_chunk = TokenChunk(chunk)
+        for word in words:
+            token_chunk.replace(word)
+        left.append(token_chunk.remaining())
+    return left
+
+
+def main(number: ("Iterations per repeat", 'option', 'n', int)=2000,
+         repeat: ("Repeats, best one is reported", 'option', 'r', int)=5):
+    streams = term_streams()
+    assert run_string(streams) == run_tokens(streams), "implementations disagree"
+
+    for name, func in (('fuzzy_replace', run_string), ('TokenChunk', run_tokens)):
+        best = min(timeit.repeat(lambda: func(streams), number=number, repeat=repeat))
+        print('{:<14} {:.2f} us per regression set'.format(name, best / number * 1e6))
+
+
+if __name__ == "__main__":
+    import plac
+
+    plac.call(main)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from data import REGRESSION_SET
+from lookup_attributes import lookup_attributes, get_magia_search, instrumentation
+from lookup_attributes.search import get_test_data
+
+CHUNK_KEYS = ('chunk', 'sentence', 'text', 'query')
+
+# allowed slowdown against the baseline before the run fails
+LATENCY_TOLERANCE = 0.2
+
+
+def read_jsonl(filename):
+    """
+    Return (chunk, expected or None) records of a JSONL request log.
+
+    The chunk is taken from the first of CHUNK_KEYS present, `expected` is optional;
+    lines without a chunk are skipped.
+    """
+    records = []
+    skipped = 0
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            request = json.loads(line)
+            chunk = next((request[k] for k in CHUNK_KEYS if isinstance(request.get(k), str)), None)
+            if chunk is None:
+                skipped += 1
+                continue
+            records.append((chunk, request.get('expected')))
+    if skipped:
+        print('{}: skipped {} lines without {}'.format(filename, skipped, '/'.join(CHUNK_KEYS)))
+    return records
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def expected_values(expected):
+    """
+    Flatten expected attribute values into strings: a list value, or a JSON list
+    string, holds several; values of attributes without one (None) are dropped
+    """
+    values = []
+    for value in expected:
+        if isinstance(value, str) and value.startswith('['):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        if isinstance(value, (list, tuple)):
+            values += expected_values(value)
+        elif value is not None:
+            values.append(str(value))
+    return values
+
+
+def is_correct(result, expected):
+    return sorted(r.lower() for r in result) == sorted(e.lower() for e in expected_values(expected))
+
+
+def replay(records, concurrency=1, mode=None):
+    """
+    Run lookup_attributes over (chunk, expected) records and return the benchmark report
+    """
+    magia_search = get_magia_search()
+    opens_before = magia_search.searcher_pool.opens
+
+    def run(record):
+        chunk, expected = record
+        started = time.time()
+        result = lookup_attributes(chunk, mode=mode)
+        return time.time() - started, sorted(result)
+
+    started = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        timings = list(executor.map(run, records))
+    elapsed = time.time() - started
+
+    latencies = [t for t, _ in timings]
+    scored = [(result, expected) for (_, result), (_, expected) in zip(timings, records) if expected is not None]
+    correct = sum(1 for result, expected in scored if is_correct(result, expected))
+    return dict(requests=len(records),
+                concurrency=concurrency,
+                seconds=elapsed,
+                throughput=len(records) / elapsed if elapsed else 0.0,
+                p50=percentile(latencies, 50),
+                p95=percentile(latencies, 95),
+                p99=percentile(latencies, 99),
+                searcher_opens_per_request=(magia_search.searcher_pool.opens - opens_before) / max(len(records), 1),
+                result_cache=magia_search.result_cache.stats(),
+                accuracy=correct / len(scored) if scored else None,
+                scored=len(scored),
+                outputs={chunk: result for (chunk, _), (_, result) in zip(records, timings)})
+
+
+def compare(report, baseline):
+    """
+    Return a list of regressions of report against a saved baseline report
+    """
+    problems = []
+    if baseline.get('concurrency', report['concurrency']) != report['concurrency']:
+        print('Note: baseline was recorded at concurrency {}'.format(baseline['concurrency']))
+    if baseline.get('accuracy') is not None and report['accuracy'] is not None \
+            and report['accuracy'] < baseline['accuracy']:
+        problems.append('accuracy {:.3f} < baseline {:.3f}'.format(report['accuracy'], baseline['accuracy']))
+    for key in ('p50', 'p95', 'p99'):
+        if report[key] > baseline[key] * (1 + LATENCY_TOLERANCE):
+            problems.append('{} {:.4f}s > baseline {:.4f}s'.format(key, report[key], baseline[key]))
+    for chunk, result in report['outputs'].items():
+        expected = baseline.get('outputs', {}).get(chunk)
+        if expected is not None and expected != result:
+            problems.append('output changed for {!r}: {} -> {}'.format(chunk, expected, result))
+    return problems
+
+
+def print_report(report):
+    print('{requests} requests at concurrency {concurrency} in {seconds:.2f}s, '
+          '{throughput:.1f} req/s'.format(**report))
+    print('latency p50 {:.1f}ms p95 {:.1f}ms p99 {:.1f}ms'.format(report['p50'] * 1000, report['p95'] * 1000,
+                                                                report['p99'] * 1000))
+    print('searcher opens per request {:.3f}, result cache hit rate {:.1%}'.format(
+        report['searcher_opens_per_request'], report['result_cache']['hit_rate']))
+    if report['accuracy'] is not None:
+        print('accuracy {:.1%} on {} requests with expected attributes'.format(report['accuracy'], report['scored']))
+
+
+def print_stages(snapshot):
+    for name, h in snapshot['stages'].items():
+        print('{:<16} mean {:7.2f}ms p95 {:7.2f}ms'.format(name, h['mean'] * 1000, h['p95'] * 1000))
+    for name, h in snapshot['counters'].items():
+        print('{:<16} mean {:7.2f}  max {:g}'.format(name, h['mean'], h['max']))
+
+
+def main(jsonl: ("Replay a JSONL request log", 'option', 'j')=None,
+         csv: ("Replay a test data CSV like test_data.csv", 'option', 'c')=None,
+         regression: ("Replay the main.py regression set", 'flag', 'r')=False,
+         concurrency: ("Concurrent lookups", 'option', 'n', int)=1,
+         limit: ("Replay at most this many requests", 'option', 'l', int)=None,
+         mode: ("Extraction mode: iterative or single_pass", 'option', 'm')=None,
+         no_cache: ("Disable the search result cache", 'flag', 'C')=False,
+         baseline: ("Compare against this saved report, exit 1 on regressions", 'option', 'b')=None,
+         save: ("Save the report as a baseline to this file", 'option', 's')=None,
+         stages: ("Print per-stage timings and counters", 'flag', 'i')=False):
+    if no_cache:
+        config.RESULT_CACHE_SIZE = 0
+    if stages:
+        config.INSTRUMENTATION = True
+    records = []
+    if jsonl:
+        records += read_jsonl(jsonl)
+    if csv or not (jsonl or regression):
+        records += get_test_data(csv or config.TEST_DATA_CSV)
+    if regression:
+        records += REGRESSION_SET
+    if limit:
+        records = records[:limit]
+
+    report = replay(records, concurrency=concurrency, mode=mode)
+    print_report(report)
+    if stages:
+        print_stages(instrumentation.snapshot())
+
+    if save:
+        with open(save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(save))
+    if baseline:
+        with open(baseline, 'r') as f:
+            problems = compare(report, json.load(f))
+        for problem in problems:
+            print('REGRESSION: {}'.format(problem))
+        if problems:
+            sys.exit(1)
+        print('No regressions against {}'.format(baseline))
+
+
+if __name__ == "__main__":
+    import plac
+
+    plac.call(main)
@@ -1,4 +1,39 @@
 INDEXDIR_PATH = "indexdir"
 DICTIONARY_FILENAME = "magia_dictionary_en.txt"
 CORRECTOR = False
-TEST_DATA_CSV="test_data.csv"
\ No newline at end of file
+TEST_DATA_CSV="test_data.csv"
+IDF_CACHE_SIZE = 10000
+EXTRACTION_MODE = "iterative"  # or "single_pass"
+SINGLE_PASS_CANDIDATES = 50  # hits each single-pass search picks attributes from
+EXACT_PREPASS = False  # take dictionary phrases found verbatim in the chunk before the fuzzy search
+EXACT_PREPASS_MIN_TOKENS = 2  # shortest phrase, in tokens, the exact pre-pass takes
+QUERY_PLANNER = False  # try exact, then fuzzy, then bigram query tiers until the top hit consumes every token
+SEARCH_LIMIT = 20  # hits re-scored per search, several hundred are fine since every match is scored anyway
+VECTORIZE_MIN_HITS = 32  # re-score batches this large with NumPy when it is installed, 0 to never use it
+
+DOMAIN_DICTIONARY_CSV = "domain_dictionary.csv"
+INDEX_LIMITMB = 256  # indexing memory per writer process
+INDEX_PROCS = 1
+INDEX_MULTISEGMENT = False  # with INDEX_PROCS > 1, keep one segment per process instead of merging
+INDEX_FLUSH_EVERY = 0  # commit a segment every N documents, 0 to commit once at the end
+INDEX_OPTIMIZE = True  # merge flushed segments into one at the end, results depend on the layout
+MERGE_LOCK_TIMEOUT = 60  # seconds a background segment merge waits for another writer to release the index
+
+CREATE_INDEX_IF_MISSING = False  # build INDEXDIR_PATH on first use instead of failing
+SEARCHER_REFRESH_INTERVAL = 1.0  # seconds between index generation checks per thread
+RESULT_CACHE_SIZE = 4096  # search results cached per token tuple, 0 disables the cache
+RESULT_CACHE_TTL = 300  # seconds, None to keep entries until evicted
+FUZZY_INDEX = True  # expand FuzzyTerms through a vocabulary index saved next to INDEXDIR_PATH
+DOC_STATS = True  # re-score hits from per-document token weights saved next to INDEXDIR_PATH
+STORED_COLUMNS = True  # read hit text and attribute code from a memory-mapped file next to INDEXDIR_PATH
+RANKING = "rescore"  # or "weighting": apply the unmatched-token penalty inside the Whoosh collector
+TYPO_CACHE_SIZE = 50000  # memoized fuzzy token expansions, 0 disables the typo cache
+TYPO_CACHE_WARM = 2000  # most frequent dictionary words and bigrams resolved by main.py -w
+SHARD_BY = None  # "attribute" or "hash": search one index per shard under INDEXDIR_PATH + ".shards"
+SHARD_COUNT = 4  # shards with SHARD_BY = "hash"
+SHARD_WORKERS = 4  # threads searching the shards of one query in parallel
+INSTRUMENTATION = False  # record per-stage lookup timings into instrumentation histograms
+
+ASYNC_WORKERS = 4  # lookup threads behind alookup_attributes
+ASYNC_MAX_CONCURRENCY = 8  # lookups queued or running at once, further callers wait
+ASYNC_TIMEOUT = None  # seconds a caller waits for its lookup, None to wait forever
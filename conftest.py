@@ -0,0 +1,2 @@
+# Keeps the repository root on sys.path, so tests import config, data and lookup_attributes
+# like main.py does; run them from the repository root, where the index lives.
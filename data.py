@@ -4,3 +4,23 @@ SENTENCES = ["how are yoou",
              "chateau latour",
              "chateau latour merus",
              "blak opul"]
+
+# main.py regression set: (chunk, expected attributes)
+REGRESSION_SET = [
+    # ("Do you have something like the 2005 Zinfandel of Turley?".lower(), []),
+    ("redd wine nappa chateau latoor", []),
+    ("nappa valley", ['napa valley']),
+    ("latour", ['chateau latour']),
+    ("red chateu latour", ['red', 'chateau latour']),
+    ("red", ['red']),
+    ("red chateau lator", ['red', 'chateau latour']),
+    ("cabernet sauvignon", ['cabernet sauvignon']),
+    ("caubernet sauvignon", ['cabernet sauvignon']),
+    ("cabernet savignon", ['cabernet sauvignon']),
+    ("caubernet sauvignon", ['cabernet sauvignon']),
+    ("how are yoou", []),
+    ("chateu meru lator", ['merus', 'chateau latour']),
+    ("chateau lator", ['chateau latour']),
+    ("blak opul", ['black opal']),
+    ("red caubernet sauvignon", ['red', 'cabernet sauvignon'])
+]
@@ -1 +1,11 @@
-from .search import lookup_attributes, magia_search
+from .search import lookup_attributes, get_index, get_magia_search, open_indexes
+from .normalize import remove_stopwords
+from .batch import lookup_attributes_many
+from .aio import alookup_attributes, LookupService
+
+
+def __getattr__(name):
+    # magia_search is created lazily on first access
+    if name == 'magia_search':
+        return get_magia_search()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
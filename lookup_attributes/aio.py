@@ -0,0 +1,85 @@
+import asyncio
+import contextvars
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from .search import lookup_attributes
+
+
+class LookupService:
+    """
+    Runs lookup_attributes for asyncio code on a bounded thread pool.
+
+    At most `max_concurrency` lookups are queued or running at once, identical
+    chunks in flight share one lookup, and each caller waits at most `timeout`
+    seconds. Pool threads keep their own searcher between lookups. The
+    concurrency limit and the lookups in flight are kept per event loop, so the
+    service can be used from several loops one after another or at once.
+    """
+
+    def __init__(self, max_workers=None, max_concurrency=None, timeout=None, mode=None):
+        self._executor = ThreadPoolExecutor(max_workers or config.ASYNC_WORKERS, thread_name_prefix='lookup')
+        self._max_concurrency = max_concurrency or config.ASYNC_MAX_CONCURRENCY
+        self._timeout = config.ASYNC_TIMEOUT if timeout is None else timeout
+        self._mode = mode
+        self._loops = weakref.WeakKeyDictionary()  # event loop -> (semaphore, chunk -> future)
+        self.lookups = 0
+        self.deduplicated = 0
+
+    async def lookup(self, chunk, timeout=None):
+        """
+        Return lookup_attributes(chunk); raises asyncio.TimeoutError after `timeout` seconds
+        """
+        semaphore, inflight = self._loop_state()
+        future = inflight.get(chunk)
+        if future is None:
+            future = asyncio.ensure_future(self._run(chunk, semaphore))
+            inflight[chunk] = future
+            future.add_done_callback(lambda f: self._forget(inflight, chunk, f))
+        else:
+            self.deduplicated += 1
+        timeout = self._timeout if timeout is None else timeout
+        # shield: a caller timing out must not cancel the lookup other callers wait for
+        return list(await asyncio.wait_for(asyncio.shield(future), timeout))
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            state = self._loops[loop] = (asyncio.Semaphore(self._max_concurrency), {})
+        return state
+
+    async def _run(self, chunk, semaphore):
+        async with semaphore:
+            self.lookups += 1
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, context.run, lookup_attributes, chunk, self._mode)
+
+    def _forget(self, inflight, chunk, future):
+        if inflight.get(chunk) is future:
+            del inflight[chunk]
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+_service = None
+
+
+def get_lookup_service():
+    """
+    Return the shared LookupService, created with config defaults on first use
+    """
+    global _service
+    if _service is None:
+        _service = LookupService()
+    return _service
+
+
+async def alookup_attributes(chunk, timeout=None):
+    """
+    Async lookup_attributes on the shared LookupService
+    """
+    return await get_lookup_service().lookup(chunk, timeout=timeout)
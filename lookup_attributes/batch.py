@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+
+import config
+from . import search
+
+
+def _init_worker(indexdir):
+    # every worker opens the index once, before its first chunk
+    config.INDEXDIR_PATH = indexdir
+    search.reset_magia_search()
+    search.get_magia_search()
+
+
+def _lookup(item):
+    position, chunk, mode = item
+    return position, search.lookup_attributes(chunk, mode=mode)
+
+
+def lookup_attributes_many(chunks, workers=None, chunksize=16, ordered=True, mode=None):
+    """
+    Run lookup_attributes over an iterable of chunks on a process pool.
+
+    Yields the attribute lists in input order, or (position, attributes) pairs as
+    soon as they are ready when `ordered` is False. Each of the `workers`
+    processes (default: CPU count) opens INDEXDIR_PATH once; `chunksize` chunks
+    are sent to a worker at a time. With one worker the lookups run in-process.
+    """
+    workers = workers or os.cpu_count() or 1
+    items = ((position, chunk, mode) for position, chunk in enumerate(chunks))
+
+    if workers == 1:
+        for item in items:
+            position, attributes = _lookup(item)
+            yield attributes if ordered else (position, attributes)
+        return
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(config.INDEXDIR_PATH,)) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for position, attributes in imap(_lookup, items, chunksize):
+            yield attributes if ordered else (position, attributes)
@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Bounded thread-safe mapping that evicts the least recently used entry.
+
+    With `ttl` (seconds) entries also expire that long after they were stored.
+    Lookups are counted in `hits` and `misses`.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self._maxsize <= 0:
+            return
+        expires = time.time() + self._ttl if self._ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def items(self):
+        """
+        Return a list of the unexpired (key, value) pairs, least recently used first
+        """
+        now = time.time()
+        with self._lock:
+            return [(key, value) for key, (value, expires) in self._data.items()
+                    if expires is None or expires >= now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return dict(size=len(self._data), maxsize=self._maxsize, ttl=self._ttl, hits=self.hits,
+                    misses=self.misses, hit_rate=self.hits / total if total else 0.0)
@@ -0,0 +1,68 @@
+import sys
+
+from .cache import LRUCache
+from .field_names import TEXT_FIELD
+from .schema import analyzer
+from .scoring_context import ScoringContext
+from .search_result import compute_tf
+from .sidecar import get_sidecar, save_sidecar
+
+SIDECAR_NAME = 'doc_stats'
+
+
+class DocStats:
+    """
+    Analyzed text_value statistics of every document of one index generation.
+
+    `weights[docnum]` holds a (token, tf * idf) pair per distinct token of the
+    document, so re-scoring a hit is a sum over the tokens the query missed
+    instead of analyzing its text and looking up IDF values again.
+    """
+
+    def __init__(self, generation, weights):
+        self.generation = generation
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.weights)
+
+    def get(self, docnum):
+        if 0 <= docnum < len(self.weights):
+            return self.weights[docnum]
+        return None
+
+
+def document_weights(text, context):
+    """
+    Return ((token, tf * idf), ...) for the distinct tokens of a text_value
+    """
+    tokens = [t.text for t in analyzer(text)]
+    tf = compute_tf(tokens)
+    return tuple((sys.intern(token), tf[token] * context.idf(token, TEXT_FIELD)) for token in tf)
+
+
+def build_doc_stats(ix, save=True):
+    """
+    Build the DocStats of the latest index generation and save it next to the index
+    """
+    with ix.searcher() as s:
+        reader = s.reader()
+        generation = reader.generation()
+        context = ScoringContext(s, LRUCache(maxsize=1 << 20))
+        weights = [None] * reader.doc_count_all()
+        for docnum, fields in reader.iter_docs():
+            text = fields.get(TEXT_FIELD)
+            if text is not None:
+                weights[docnum] = document_weights(text, context)
+    doc_stats = DocStats(generation, weights)
+    if save:
+        save_sidecar(ix, SIDECAR_NAME, generation, doc_stats)
+    return doc_stats
+
+
+def get_doc_stats(ix, generation, build=False):
+    """
+    Return the DocStats saved for an index generation, building it when missing
+    and `build` is set; None if it is not available
+    """
+    return get_sidecar(ix, SIDECAR_NAME, generation, build_doc_stats if build else None)
@@ -1,4 +1,5 @@
 TEXT_FIELD = 'text_value'
 BIGRAMS_FIELD = 'word_bigrams'
 NONBRAND_TEXT_FIELD = 'non_brand_text_value'
-ATTRIBUTE_FIELD = 'attribute_code'
\ No newline at end of file
+ATTRIBUTE_FIELD = 'attribute_code'
+NODE_ID_FIELD = 'node_id'
@@ -0,0 +1,226 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+from Levenshtein import distance
+from whoosh.query import FuzzyTerm
+
+from .field_names import TEXT_FIELD, BIGRAMS_FIELD
+from .sidecar import get_sidecar, save_sidecar
+
+SIDECAR_NAME = 'fuzzy_index'
+
+# exact prefix length the vocabulary of each field is bucketed by, the smallest
+# prefixlength MagiaSearch.build_query uses for FuzzyTerms on that field
+FIELD_PREFIXES = {TEXT_FIELD: 1, BIGRAMS_FIELD: 3}
+# fields whose vocabulary also gets a character q-gram index, bigrams have the largest maxdist
+QGRAM_FIELDS = (BIGRAMS_FIELD,)
+QGRAM = 3
+QGRAM_MIN_WINDOW = 256  # smaller length windows are scanned, the q-gram count does not pay off
+
+
+class FuzzyVocabulary:
+    """
+    Terms of one field bucketed by their first `prefixlength` characters and length.
+
+    A fuzzy lookup only reads the buckets of the query prefix within `maxdist`
+    of the query length and checks those terms with Levenshtein distance, which
+    gives the same terms as Whoosh's Levenshtein automaton walk.
+    """
+
+    def __init__(self, terms, prefixlength):
+        self.prefixlength = prefixlength
+        self.buckets = defaultdict(list)
+        for term in terms:
+            self.buckets[(term[:prefixlength], len(term))].append(term)
+        self.buckets = dict(self.buckets)
+
+    def terms_within(self, text, maxdist, prefix=0):
+        """
+        Return the sorted terms within `maxdist` edits of text sharing its first
+        `prefix` characters, or None if prefix is shorter than the bucket prefix
+        """
+        if prefix < self.prefixlength:
+            return None
+        head = text[:self.prefixlength]
+        required = text[:prefix]
+        result = []
+        for length in range(len(text) - maxdist, len(text) + maxdist + 1):
+            for term in self.buckets.get((head, length), ()):
+                if term.startswith(required) and distance(text, term) <= maxdist:
+                    result.append(term)
+        # Whoosh expands terms in term dictionary order
+        result.sort()
+        return result
+
+
+class QGramVocabulary(FuzzyVocabulary):
+    """
+    FuzzyVocabulary with a character q-gram index per term prefix.
+
+    Terms sharing a prefix are numbered by length and every padded q-gram after
+    the prefix lists the numbers of the terms containing it. A lookup whose length
+    window holds at least `min_window` terms counts the q-grams each of them shares
+    with the query and only checks terms reaching the q-gram count bound of
+    `maxdist` edits with Levenshtein distance, which gives the same terms as the
+    bucket scan. The q-gram index of a prefix is built on its first such lookup
+    and not saved with the vocabulary.
+    """
+
+    def __init__(self, terms, prefixlength, q=QGRAM, min_window=QGRAM_MIN_WINDOW):
+        FuzzyVocabulary.__init__(self, terms, prefixlength)
+        self.q = q
+        self.min_window = min_window
+        self.max_length = max((length for head, length in self.buckets), default=0)
+        self._heads = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_heads'] = {}
+        return state
+
+    def _head_index(self, head):
+        entry = self._heads.get(head)
+        if entry is None:
+            terms = [term for length in range(self.max_length + 1) for term in self.buckets.get((head, length), ())]
+            postings = defaultdict(list)
+            for number, term in enumerate(terms):
+                for gram in set(self.qgrams(term)):
+                    postings[gram].append(number)
+            # concurrent lookups may build the same entry, either copy is complete
+            entry = self._heads[head] = (terms, array('I', [len(term) for term in terms]),
+                                         {gram: array('I', numbers) for gram, numbers in postings.items()})
+        return entry
+
+    def qgrams(self, text):
+        """
+        Return the padded q-grams of text, without the ones its prefix determines
+        """
+        padded = '\0' * (self.q - 1) + text + '\1' * (self.q - 1)
+        return [padded[i:i + self.q] for i in range(self.prefixlength, len(padded) - self.q + 1)]
+
+    def terms_within(self, text, maxdist, prefix=0):
+        if prefix < self.prefixlength:
+            return None
+        # strings within maxdist edits share at least len + q - 1 - maxdist * q padded
+        # q-grams, the first prefixlength of them are the shared prefix
+        needed = len(text) + self.q - 1 - maxdist * self.q - self.prefixlength
+        head = text[:self.prefixlength]
+        if needed <= 0 or sum(len(self.buckets.get((head, length), ()))
+                              for length in range(len(text) - maxdist, len(text) + maxdist + 1)) < self.min_window:
+            return FuzzyVocabulary.terms_within(self, text, maxdist, prefix)
+        terms, lengths, postings = self._head_index(head)
+        first, last = bisect_left(lengths, len(text) - maxdist), bisect_right(lengths, len(text) + maxdist)
+        numbers = []
+        for gram, count in Counter(self.qgrams(text)).items():
+            posting = postings.get(gram)
+            if posting:
+                posting = posting[bisect_left(posting, first):bisect_left(posting, last)]
+                # counting a repeated query q-gram for every term containing it only overestimates
+                numbers.extend(posting * count if count > 1 else posting)
+        required = text[:prefix]
+        result = [terms[number] for number, shared in Counter(numbers).items()
+                  if shared >= needed and terms[number].startswith(required)
+                  and distance(text, terms[number]) <= maxdist]
+        result.sort()
+        return result
+
+
+def leaf_terms_within(reader, fieldname, text, maxdist, prefix=0):
+    """
+    Return the sorted terms a FuzzyTerm search matches on a reader.
+
+    Whoosh searches segment by segment and every segment expands FuzzyTerms with
+    a Levenshtein automaton, while terms_within of a multi-segment reader checks
+    Damerau-Levenshtein distance and also takes a transposition as one edit.
+    """
+    terms = set()
+    for leaf, _ in reader.leaf_readers():
+        terms.update(leaf.terms_within(fieldname, text, maxdist, prefix))
+    return sorted(terms)
+
+
+class FuzzyIndex:
+    """
+    Precomputed fuzzy term expansion for the fields in FIELD_PREFIXES of one index generation.
+
+    Terms are checked with Levenshtein distance like the per-segment expansion of
+    a FuzzyTerm search, so a multi-segment index still expands a transposition
+    typo as two edits, see leaf_terms_within.
+    """
+
+    def __init__(self, generation, vocabularies):
+        self.generation = generation
+        self.vocabularies = vocabularies
+
+    def __deepcopy__(self, memo):
+        # Whoosh deep copies queries while normalizing them; the index is read-only and shared
+        return self
+
+    def terms_within(self, fieldname, text, maxdist, prefix=0):
+        vocabulary = self.vocabularies.get(fieldname)
+        if vocabulary is None:
+            return None
+        return vocabulary.terms_within(text, maxdist, prefix)
+
+
+class IndexedFuzzyTerm(FuzzyTerm):
+    """
+    FuzzyTerm expanded through a FuzzyIndex, or a TypoResolver in front of one,
+    instead of the term dictionary.
+
+    Falls back to the per-segment expansion of leaf_terms_within for fields or
+    prefixes `fuzzy_index` does not cover. The expansion is kept, so estimating
+    the size and matching expand the term once.
+    """
+
+    def __init__(self, fieldname, text, boost=1.0, maxdist=1, prefixlength=1, constantscore=True,
+                 fuzzy_index=None):
+        FuzzyTerm.__init__(self, fieldname, text, boost=boost, maxdist=maxdist, prefixlength=prefixlength,
+                           constantscore=constantscore)
+        self.fuzzy_index = fuzzy_index
+        self._expanded = None
+
+    def _btexts(self, ixreader):
+        if self._expanded is None:
+            if self.fuzzy_index is not None:
+                self._expanded = self.fuzzy_index.terms_within(self.fieldname, self.text, self.maxdist,
+                                                               self.prefixlength)
+            if self._expanded is None:
+                return leaf_terms_within(ixreader, self.fieldname, self.text, self.maxdist, self.prefixlength)
+        return self._expanded
+
+
+def fuzzy_term(fieldname, text, fuzzy_index=None, **kwargs):
+    """
+    Return a FuzzyTerm, expanded through fuzzy_index (a FuzzyIndex or TypoResolver) when one is given
+    """
+    if fuzzy_index is None:
+        return FuzzyTerm(fieldname, text, **kwargs)
+    return IndexedFuzzyTerm(fieldname, text, fuzzy_index=fuzzy_index, **kwargs)
+
+
+def build_fuzzy_index(ix, save=True):
+    """
+    Build the FuzzyIndex of the latest index generation and save it next to the index
+    """
+    with ix.searcher() as s:
+        reader = s.reader()
+        generation = reader.generation()
+        vocabularies = {}
+        for fieldname, prefixlength in FIELD_PREFIXES.items():
+            terms = (term.decode('utf-8') for term in reader.lexicon(fieldname))
+            vocabulary_class = QGramVocabulary if fieldname in QGRAM_FIELDS else FuzzyVocabulary
+            vocabularies[fieldname] = vocabulary_class(terms, prefixlength)
+    fuzzy_index = FuzzyIndex(generation, vocabularies)
+    if save:
+        save_sidecar(ix, SIDECAR_NAME, generation, fuzzy_index)
+    return fuzzy_index
+
+
+def get_fuzzy_index(ix, generation, build=False):
+    """
+    Return the FuzzyIndex saved for an index generation, building it when missing
+    and `build` is set; None if it is not available
+    """
+    return get_sidecar(ix, SIDECAR_NAME, generation, build_fuzzy_index if build else None)
@@ -0,0 +1,309 @@
+import csv
+import logging
+import os
+import resource
+import threading
+import time
+
+import whoosh.index as index
+from whoosh.index import LockError
+
+import config
+from .doc_stats import build_doc_stats, get_doc_stats
+from .field_names import NODE_ID_FIELD
+from .fuzzy_index import build_fuzzy_index, get_fuzzy_index
+from .phrase_automaton import build_phrase_automaton, get_phrase_automaton
+from .schema import schema
+from .sidecar import remove_sidecars
+from .stored_columns import build_stored_columns, get_stored_columns
+from .typo_cache import TypoCache
+
+
+logger = logging.getLogger('lookup_attributes.indexing')
+
+
+def find_ngrams(l: list, n: int):
+    return list(zip(*[l[i:] for i in range(n)]))
+
+
+def create_dir(directory):
+    """
+    Create directory if not exists
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+
+def document_from_row(row):
+    """
+    Return index document fields for a dictionary CSV row, or None if the row is skipped
+    """
+    text_value = row['text_value'].lower().strip()
+    if not text_value or row.get('entity_type', None) not in ['node', None]:
+        return None
+    # TODO add StandartAnalyzer
+    bigrams = find_ngrams(text_value.split(), 2)
+    text_bigrams = ['_'.join(b) for b in bigrams]
+    # if this is not a brand then add that also so we can give pref to non-brands
+    non_brand_text = text_value if row.get('attribute_code', None) != "brand" else None
+    return dict(text_value=text_value,
+                word_bigrams=text_bigrams,
+                non_brand_text_value=non_brand_text,
+                attribute_code=row['attribute_code'],
+                node_id=row['entity_id'])  # TODO add node_id to source table
+
+
+def iter_dictionary_rows(filename):
+    """
+    Stream CSV rows of the domain dictionary without loading the file
+    """
+    with open(filename, 'r') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def peak_rss_kb():
+    """
+    Return peak resident set size in KB of this process and of its finished children
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own, children
+
+
+def update_sidecars(ix, missing=False):
+    """
+    Rebuild the structures derived from the latest index generation; with
+    `missing` only build the ones not saved yet.
+
+    Searches only load these structures, so they are built here after every
+    index change and by main.py -b. The saved typo cache is carried over to the
+    latest generation.
+    """
+    generation = ix.latest_generation()
+    for enabled, build, get in ((config.FUZZY_INDEX, build_fuzzy_index, get_fuzzy_index),
+                                (config.DOC_STATS, build_doc_stats, get_doc_stats),
+                                (config.EXACT_PREPASS, build_phrase_automaton, get_phrase_automaton),
+                                (config.STORED_COLUMNS, build_stored_columns, get_stored_columns)):
+        if not enabled:
+            continue
+        if missing:
+            get(ix, generation, build=True)
+        else:
+            build(ix)
+    if config.TYPO_CACHE_SIZE:
+        fuzzy_index = get_fuzzy_index(ix, generation) if config.FUZZY_INDEX else None
+        reader = ix.reader()
+        try:
+            TypoCache(config.TYPO_CACHE_SIZE).carry_over(ix, reader, fuzzy_index)
+        finally:
+            reader.close()
+
+
+class IndexBuildStats:
+    def __init__(self):
+        self.rows = 0
+        self.indexed = 0
+        self.segments = 0
+        self.started = time.time()
+        self.seconds = 0.0
+        self.sidecar_seconds = 0.0  # sidecar rebuild after the commit, not part of seconds
+        self.peak_rss_kb = 0
+        self.peak_children_rss_kb = 0
+
+    @property
+    def rows_per_sec(self):
+        elapsed = self.seconds or (time.time() - self.started)
+        return self.rows / elapsed if elapsed else 0.0
+
+    def finish(self):
+        self.seconds = time.time() - self.started
+        self.peak_rss_kb, self.peak_children_rss_kb = peak_rss_kb()
+
+    def __str__(self):
+        return ("{} rows read, {} indexed in {} commits, {:.1f}s ({:.0f} rows/sec), sidecars {:.1f}s, "
+                "peak RSS {} KB (workers {} KB)").format(self.rows, self.indexed, self.segments, self.seconds,
+                                                        self.rows_per_sec, self.sidecar_seconds, self.peak_rss_kb,
+                                                        self.peak_children_rss_kb)
+
+
+def build_index(directory, filename=None, limitmb=None, procs=None, multisegment=None, flush_every=None,
+                optimize=None, document_filter=None):
+    """
+    Stream the dictionary CSV into a new Whoosh index.
+
+    Documents are written with a writer limited to `limitmb` MB of indexing memory
+    (per process when `procs` > 1) and committed as a new segment every
+    `flush_every` documents, so memory stays bounded on large dictionaries.
+    With `optimize` the flushed segments are merged into one at the end; search
+    results depend on the segment layout, so this is the default.
+    With `document_filter` only the documents it returns True for are indexed.
+    Returns the index and an IndexBuildStats.
+    """
+    filename = filename or config.DOMAIN_DICTIONARY_CSV
+    limitmb = limitmb or config.INDEX_LIMITMB
+    procs = procs or config.INDEX_PROCS
+    multisegment = config.INDEX_MULTISEGMENT if multisegment is None else multisegment
+    flush_every = config.INDEX_FLUSH_EVERY if flush_every is None else flush_every
+    optimize = config.INDEX_OPTIMIZE if optimize is None else optimize
+
+    print('Generating index in {}'.format(directory))
+    create_dir(directory)
+    ix = index.create_in(directory, schema)
+    remove_sidecars(ix)
+    stats = IndexBuildStats()
+
+    def new_writer():
+        return ix.writer(limitmb=limitmb, procs=procs, multisegment=multisegment)
+
+    writer = new_writer()
+    for row in iter_dictionary_rows(filename):
+        if not stats.rows % 10000:
+            print('{} rows, {:.0f} rows/sec'.format(stats.rows, stats.rows_per_sec))
+        stats.rows += 1
+        document = document_from_row(row)
+        if document is None or (document_filter and not document_filter(document)):
+            continue
+        writer.add_document(**document)
+        stats.indexed += 1
+        if flush_every and not stats.indexed % flush_every:
+            writer.commit(merge=False)
+            stats.segments += 1
+            writer = new_writer()
+    print('Writing {} records...'.format(stats.indexed))
+    writer.commit(optimize=optimize)
+    stats.segments += 1
+    stats.finish()
+    started = time.time()
+    update_sidecars(ix)
+    stats.sidecar_seconds = time.time() - started
+    print("{} elements indexed".format(stats.indexed))
+    print(stats)
+    return ix, stats
+
+
+def create_index(directory, **options):
+    """
+    Generate Whoosh index from text file
+    """
+    ix, stats = build_index(directory, **options)
+    return ix
+
+
+class IndexSyncStats:
+    def __init__(self):
+        self.added = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.duplicates = 0
+        self.started = time.time()
+        self.seconds = 0.0
+        self.sidecar_seconds = 0.0  # sidecar rebuild after the commit, not part of seconds
+        self.merge_thread = None
+
+    @property
+    def changed(self):
+        return self.added + self.updated + self.deleted
+
+    def finish(self):
+        self.seconds = time.time() - self.started
+
+    def __str__(self):
+        return ("{} added, {} updated, {} deleted, {} unchanged ({} duplicate node ids in source), "
+                "{:.1f}s, sidecars {:.1f}s").format(self.added, self.updated, self.deleted, self.unchanged,
+                                                    self.duplicates, self.seconds, self.sidecar_seconds)
+
+
+def _source_documents(filename, stats, document_filter=None):
+    documents = {}
+    for row in iter_dictionary_rows(filename):
+        document = document_from_row(row)
+        if document is None or (document_filter and not document_filter(document)):
+            continue
+        if document[NODE_ID_FIELD] in documents:
+            stats.duplicates += 1
+        # the last row wins for a repeated node id
+        documents[document[NODE_ID_FIELD]] = document
+    return documents
+
+
+def _indexed_documents(ix):
+    indexed = {}
+    with ix.searcher() as s:
+        for docnum, fields in s.reader().iter_docs():
+            node_id = fields.get(NODE_ID_FIELD)
+            key = (fields.get('text_value'), fields.get('attribute_code'))
+            # a node id indexed twice never equals a single source row, forcing an update
+            indexed[node_id] = key if node_id not in indexed else None
+    return indexed
+
+
+def merge_segments(ix, timeout=None):
+    """
+    Merge all index segments into one, waiting up to `timeout` seconds (default
+    config.MERGE_LOCK_TIMEOUT) for another writer to release the index.
+    Returns False, leaving the segments as they are, if the lock stays taken.
+    """
+    timeout = config.MERGE_LOCK_TIMEOUT if timeout is None else timeout
+    try:
+        ix.optimize(timeout=timeout)
+    except LockError:
+        logger.warning("Segment merge of %s skipped, the index stayed locked by another writer for %ss",
+                       ix.storage.folder, timeout)
+        return False
+    update_sidecars(ix)
+    return True
+
+
+def sync_index(ix, filename=None, merge=False, background_merge=False, limitmb=None, document_filter=None):
+    """
+    Apply dictionary CSV changes to an existing index instead of rebuilding it.
+
+    Source rows and indexed documents are matched by node_id: new ids are added,
+    rows whose text or attribute changed are replaced with update_document and
+    ids missing from the source are deleted. With `merge` the commit merges small
+    segments as usual; `background_merge` instead merges all segments in a daemon
+    thread after the commit, available as stats.merge_thread. With
+    `document_filter` only the source documents it returns True for are synced.
+    Returns an IndexSyncStats.
+    """
+    filename = filename or config.DOMAIN_DICTIONARY_CSV
+    limitmb = limitmb or config.INDEX_LIMITMB
+    field = ix.schema[NODE_ID_FIELD]
+    if not (field.indexed and field.unique):
+        raise ValueError("Index has no unique {} field, rebuild it with create_index".format(NODE_ID_FIELD))
+
+    stats = IndexSyncStats()
+    documents = _source_documents(filename, stats, document_filter)
+    indexed = _indexed_documents(ix)
+
+    writer = None
+    for node_id in indexed:
+        if node_id not in documents:
+            writer = writer or ix.writer(limitmb=limitmb)
+            writer.delete_by_term(NODE_ID_FIELD, node_id)
+            stats.deleted += 1
+    for node_id, document in documents.items():
+        if node_id not in indexed:
+            stats.added += 1
+        elif indexed[node_id] != (document['text_value'], document['attribute_code']):
+            stats.updated += 1
+        else:
+            stats.unchanged += 1
+            continue
+        writer = writer or ix.writer(limitmb=limitmb)
+        writer.update_document(**document)
+
+    if writer is not None:
+        writer.commit(merge=merge)
+    stats.finish()
+    if writer is not None:
+        started = time.time()
+        update_sidecars(ix)
+        stats.sidecar_seconds = time.time() - started
+        if background_merge:
+            stats.merge_thread = threading.Thread(target=merge_segments, args=(ix,), daemon=True)
+            stats.merge_thread.start()
+    print(stats)
+    return stats
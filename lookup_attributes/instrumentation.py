@@ -0,0 +1,113 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import config
+from .metrics import Histogram
+
+STAGES = ('stopwords', 'exact_prepass', 'query_build', 'whoosh_search', 'rescoring', 'fuzzy_replace')
+COUNTERS = ('iterations', 'fuzzy_expansions', 'hits_scored', 'cache_hits', 'exact_tier', 'fuzzy_tier', 'bigram_tier')
+
+_request = ContextVar('lookup_attributes_request', default=None)
+_collected = ContextVar('lookup_attributes_requests', default=None)
+
+stage_latency = {name: Histogram() for name in STAGES + ('total',)}
+counter_values = {name: Histogram(tuple(2 ** i for i in range(12))) for name in COUNTERS}
+
+
+class RequestStats:
+    """
+    Stage timings in seconds and counters of one lookup_attributes call
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.total = 0.0
+
+    def as_dict(self):
+        return dict(self.stages, total=self.total, **self.counters)
+
+
+def active():
+    """
+    Return True if the current lookup is being instrumented
+    """
+    return _request.get() is not None
+
+
+def begin():
+    """
+    Start instrumenting a lookup; returns a token for end(), or None when
+    config.INSTRUMENTATION is off and no measure() block is collecting
+    """
+    if not config.INSTRUMENTATION and _collected.get() is None:
+        return None
+    stats = RequestStats()
+    return stats, _request.set(stats)
+
+
+def end(token):
+    stats, reset = token
+    _request.reset(reset)
+    stats.total = time.perf_counter() - stats.started
+    if config.INSTRUMENTATION:
+        for name in STAGES:
+            stage_latency[name].observe(stats.stages[name])
+        stage_latency['total'].observe(stats.total)
+        for name in COUNTERS:
+            counter_values[name].observe(stats.counters[name])
+    collected = _collected.get()
+    if collected is not None:
+        collected.append(stats.as_dict())
+    return stats
+
+
+def start():
+    """
+    Return a start time for stop(), or None when the lookup is not instrumented
+    """
+    return time.perf_counter() if _request.get() is not None else None
+
+
+def stop(stage, started):
+    """
+    Add the time since start() to a stage of the current lookup
+    """
+    if started is not None:
+        stats = _request.get()
+        if stats is not None:
+            stats.stages[stage] += time.perf_counter() - started
+
+
+def count(counter, n=1):
+    stats = _request.get()
+    if stats is not None:
+        stats.counters[counter] += n
+
+
+@contextmanager
+def measure():
+    """
+    Collect per-request stage timings and counters of the enclosed lookups::
+
+        with measure() as requests:
+            lookup_attributes(chunk)
+        requests[0]['whoosh_search'], requests[0]['iterations']
+    """
+    requests = []
+    token = _collected.set(requests)
+    try:
+        yield requests
+    finally:
+        _collected.reset(token)
+
+
+def snapshot():
+    """
+    Return the aggregate stage latency and counter histograms collected while
+    config.INSTRUMENTATION was on
+    """
+    return dict(stages={name: h.snapshot() for name, h in stage_latency.items()},
+                counters={name: h.snapshot() for name, h in counter_values.items()})
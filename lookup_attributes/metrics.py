@@ -0,0 +1,57 @@
+import bisect
+import threading
+
+# bucket upper bounds in seconds, 100us .. ~100s
+DEFAULT_BOUNDS = tuple(0.0001 * 2 ** i for i in range(21))
+
+
+class Histogram:
+    """
+    Thread-safe histogram over fixed bucket bounds.
+
+    Percentiles are reported as the upper bound of the bucket they fall in, capped
+    at the largest value seen.
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self._bounds = tuple(bounds)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        """
+        Return the q-th percentile (0-100) of the observed values
+        """
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q / 100.0 * self.count
+            seen = 0
+            for i, n in enumerate(self._counts):
+                seen += n
+                if n and seen >= rank:
+                    bound = self._bounds[i] if i < len(self._bounds) else self.max
+                    return min(bound, self.max)
+            return self.max
+
+    def snapshot(self):
+        buckets = {}
+        with self._lock:
+            for i, n in enumerate(self._counts):
+                if n:
+                    buckets['+Inf' if i == len(self._bounds) else '{:g}'.format(self._bounds[i])] = n
+            count, total, maximum = self.count, self.total, self.max
+        return dict(count=count, sum=total, mean=total / count if count else 0.0, max=maximum,
+                    p50=self.percentile(50), p95=self.percentile(95), p99=self.percentile(99), buckets=buckets)
@@ -0,0 +1,31 @@
+import re
+
+from .stopwords import STOPWORDS
+
+# id(stopword list) -> (list, compiled pattern); the list is kept so its id stays valid
+_patterns = {}
+
+
+def stopword_pattern(stopwords=STOPWORDS):
+    """
+    Return one compiled alternation matching any of the given stopwords as a whole word.
+
+    Patterns are cached by list identity, so stopword lists are expected not to be
+    mutated after first use.
+    """
+    cached = _patterns.get(id(stopwords))
+    if cached is None or cached[0] is not stopwords:
+        words = sorted(set(stopwords), key=len, reverse=True)
+        pattern = re.compile(r'\b(?:' + '|'.join(re.escape(w) for w in words) + r')\b')
+        cached = _patterns[id(stopwords)] = (stopwords, pattern)
+    return cached[1]
+
+
+def remove_stopwords(sentence, stopwords=STOPWORDS):
+    """
+    Lowercase the sentence and strip stopwords in a single scan
+    """
+    sentence = sentence.strip().lower()
+    if not stopwords:
+        return sentence
+    return stopword_pattern(stopwords).sub('', sentence)
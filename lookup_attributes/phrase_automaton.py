@@ -0,0 +1,117 @@
+import sys
+from collections import deque
+
+from .field_names import TEXT_FIELD
+from .sidecar import get_sidecar, save_sidecar
+
+SIDECAR_NAME = 'phrase_automaton'
+
+
+class PhraseAutomaton:
+    """
+    Token-level Aho-Corasick automaton over the text_value phrases of one index generation.
+
+    Finds every dictionary phrase occurring in a token list in one pass over it.
+    Transitions are kept in a single dict keyed by (state, token) to stay compact.
+    """
+
+    def __init__(self, generation, phrases):
+        self.generation = generation
+        self._goto = {}
+        self._fail = [0]
+        # per state: the terminal states of the phrases ending there, own and via suffix links
+        self._outputs = [()]
+        # terminal state -> (phrase length in tokens, phrase)
+        self._phrases = {}
+        for phrase in phrases:
+            self._add(phrase)
+        self._link()
+
+    def __len__(self):
+        return len(self._phrases)
+
+    def _add(self, phrase):
+        tokens = phrase.split()
+        if not tokens:
+            return
+        state = 0
+        for token in tokens:
+            following = self._goto.get((state, token))
+            if following is None:
+                following = len(self._fail)
+                self._goto[(state, sys.intern(token))] = following
+                self._fail.append(0)
+                self._outputs.append(())
+            state = following
+        if state not in self._phrases:
+            self._phrases[state] = (len(tokens), phrase)
+            self._outputs[state] = (state,)
+
+    def _link(self):
+        children = {}
+        for (state, token), following in self._goto.items():
+            children.setdefault(state, []).append((token, following))
+        queue = deque(following for _, following in children.get(0, ()))
+        while queue:
+            state = queue.popleft()
+            for token, following in children.get(state, ()):
+                fail = self._fail[state]
+                while fail and (fail, token) not in self._goto:
+                    fail = self._fail[fail]
+                fail = self._goto.get((fail, token), 0)
+                self._fail[following] = fail
+                self._outputs[following] += self._outputs[fail]
+                queue.append(following)
+
+    def find(self, tokens):
+        """
+        Return (start, end, phrase) for all phrases occurring in tokens
+        """
+        matches = []
+        state = 0
+        for i, token in enumerate(tokens):
+            while state and (state, token) not in self._goto:
+                state = self._fail[state]
+            state = self._goto.get((state, token), 0)
+            for terminal in self._outputs[state]:
+                length, phrase = self._phrases[terminal]
+                matches.append((i + 1 - length, i + 1, phrase))
+        return matches
+
+    def longest_matches(self, tokens, min_tokens=1):
+        """
+        Return non-overlapping (start, end, phrase) matches of at least `min_tokens`
+        tokens, leftmost first and the longest phrase at each position
+        """
+        matches = sorted((m for m in self.find(tokens) if m[1] - m[0] >= min_tokens),
+                         key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        end = 0
+        for match in matches:
+            if match[0] >= end:
+                selected.append(match)
+                end = match[1]
+        return selected
+
+
+def build_phrase_automaton(ix, save=True):
+    """
+    Build the PhraseAutomaton of the latest index generation and save it next to the index
+    """
+    with ix.searcher() as s:
+        reader = s.reader()
+        generation = reader.generation()
+        phrases = {fields.get(TEXT_FIELD) for _, fields in reader.iter_docs()}
+    phrases.discard(None)
+    automaton = PhraseAutomaton(generation, sorted(phrases))
+    if save:
+        save_sidecar(ix, SIDECAR_NAME, generation, automaton)
+    return automaton
+
+
+def get_phrase_automaton(ix, generation, build=False):
+    """
+    Return the PhraseAutomaton saved for an index generation, building it when
+    missing and `build` is set; None if it is not available
+    """
+    return get_sidecar(ix, SIDECAR_NAME, generation, build_phrase_automaton if build else None)
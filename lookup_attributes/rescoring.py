@@ -0,0 +1,37 @@
+import config
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def unmatched_penalties(weights_list, matched_list):
+    """
+    Return the unmatched-token penalty of every hit.
+
+    `weights_list` holds the DocStats ((token, tf * idf), ...) of each hit and
+    `matched_list` the set of term texts that matched it. Batches of at least
+    config.VECTORIZE_MIN_HITS hits are summed with NumPy when it is installed.
+    """
+    if numpy is not None and 0 < config.VECTORIZE_MIN_HITS <= len(weights_list):
+        return _unmatched_penalties_numpy(weights_list, matched_list)
+    return [sum(weight for token, weight in weights if token not in matched)
+            for weights, matched in zip(weights_list, matched_list)]
+
+
+def _unmatched_penalties_numpy(weights_list, matched_list):
+    # matched tokens weigh 0.0, so bincount adds the same values in the same token order as sum()
+    weight = numpy.array([0.0 if token in matched else w
+                          for weights, matched in zip(weights_list, matched_list) for token, w in weights],
+                         dtype=numpy.float64)
+    hit = numpy.repeat(numpy.arange(len(weights_list)), [len(weights) for weights in weights_list])
+    return numpy.bincount(hit, weights=weight, minlength=len(weights_list)).tolist()
+
+
+def rescore(initial_scores, weights_list, matched_list):
+    """
+    Return the SearchResult scores of a batch of hits: raw score minus unmatched-token penalty
+    """
+    penalties = unmatched_penalties(weights_list, matched_list)
+    return [score - penalty for score, penalty in zip(initial_scores, penalties)]
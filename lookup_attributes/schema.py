@@ -10,4 +10,4 @@ schema = fields.Schema(text_value=fields.TEXT(stored=True, analyzer=analyzer),
                        word_bigrams=fields.TEXT(stored=True, field_boost=3.0),
                        non_brand_text_value=fields.TEXT(analyzer=analyzer, field_boost=3.0),
                        attribute_code=fields.STORED,
-                       node_id=fields.STORED)
\ No newline at end of file
+                       node_id=fields.ID(stored=True, unique=True))
\ No newline at end of file
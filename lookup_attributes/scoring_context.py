@@ -0,0 +1,44 @@
+from math import log
+
+from .field_names import TEXT_FIELD
+
+
+class ScoringContext:
+    """
+    Per-query state shared by all SearchResult objects of one search.
+
+    Reuses the searcher the query ran on and memoizes IDF values in an LRU cache
+    keyed by index generation, so re-scoring a hit does not touch the index twice.
+    """
+
+    def __init__(self, searcher, idf_cache):
+        self._searcher = searcher.get_parent()
+        self._idf_cache = idf_cache
+        # a ShardSearcher scores with the statistics of every shard generation
+        self._generation = getattr(self._searcher, 'generations', None) or self._searcher.reader().generation()
+        self._doc_count = None
+
+    @property
+    def searcher(self):
+        return self._searcher
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def doc_count(self):
+        if self._doc_count is None:
+            self._doc_count = self._searcher.doc_count_all()
+        return self._doc_count
+
+    def idf(self, text, fieldname=TEXT_FIELD):
+        """Returns the inverse document frequency of the given term.
+        """
+        key = (self._generation, fieldname, text)
+        value = self._idf_cache.get(key)
+        if value is None:
+            n = self._searcher.doc_frequency(fieldname, text)
+            value = log(self.doc_count / (n + 1)) + 1
+            self._idf_cache.put(key, value)
+        return value
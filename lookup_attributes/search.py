@@ -1,21 +1,52 @@
 import ast
+import atexit
+import contextvars
 import csv
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
 import whoosh.index as index
 from fuzzywuzzy import fuzz
+from Levenshtein import distance
 
 from whoosh.query import Term, Or, And, FuzzyTerm
+from whoosh.searching import Searcher
 
 import config
+from .cache import LRUCache
 from .field_names import TEXT_FIELD, BIGRAMS_FIELD, NONBRAND_TEXT_FIELD, ATTRIBUTE_FIELD
+from .doc_stats import get_doc_stats
+from .fuzzy_index import fuzzy_term, get_fuzzy_index, FIELD_PREFIXES
+from .phrase_automaton import get_phrase_automaton
+from .indexing import create_index, find_ngrams, update_sidecars
+from .normalize import remove_stopwords
+from .scoring_context import ScoringContext
 from .search_result import SearchResult
-from .schema import schema
+from .rescoring import rescore
+from .searcher_pool import SearcherPool
+from .sharding import ShardSearcher, ShardStats, open_shards
+from .stored_columns import get_stored_columns
+from . import instrumentation, tracing
+from .token_chunk import TokenChunk, token_ratio, REPLACED, FUZZY_RATIO
+from .typo_cache import TypoCache, dictionary_tokens
+from .weighting import UnmatchedPenaltyWeighting, query_term_texts
 # from lookup_attributes.stopwords import STOPWORDS
 
 
-REPLACED = '------'
+ITERATIVE = 'iterative'
+SINGLE_PASS = 'single_pass'
+
+RESCORE = 'rescore'
+WEIGHTING = 'weighting'
+
+# query planner tiers, cheapest first
+EXACT_TIER = 'exact'
+FUZZY_TIER = 'fuzzy'
+BIGRAM_TIER = 'bigram'
 
 
 
@@ -29,12 +60,14 @@ def fuzzy_replace(str_a, stub, orig_str):
     search for exact dictionary term in query.
     If not found, search for fuzzy term with distance < X (or some factor if using fuzzywuzzy).
 
+    String version kept for reference, lookup_attributes uses TokenChunk.replace.
+
     TODO:
     If not found, search for each exact individual terms from query results. If any remaining,
     search for fuzzywuzzy individual terms from query results
     """
 
-    RATIO = 74
+    RATIO = FUZZY_RATIO
 
     # str_a = str_a.replace('_', ' ') # bigrams
     l = len(str_a.split())  # Length to read orig_str chunk by chunk
@@ -52,60 +85,44 @@ def fuzzy_replace(str_a, stub, orig_str):
     return orig_str
 
 
-def create_dir(directory):
-    """
-    Create directory if not exists
+def get_index(directory, create=None):
     """
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    Return Whoosh index.
 
-
-def create_index(directory):
-    """
-    Generate Whoosh index from text file
-    """
-    print('Generating index in {}'.format(directory))
-    create_dir(directory)
-    ix = index.create_in(directory, schema)
-    writer = ix.writer()
-    total = 0
-    with open('domain_dictionary.csv', 'r') as f:
-        rdr = csv.DictReader(f)
-        for i, row in enumerate(rdr):
-            if not i % 10000:
-                print(i)
-            text_value = row['text_value'].lower().strip()
-            # TODO add StandartAnalyzer
-            bigrams = find_ngrams(text_value.split(), 2)
-            text_bigrams = ['_'.join(b) for b in bigrams]
-            # if this is not a brand then add that also so we can give pref to non-brands
-            non_brand_text = text_value if row.get('attribute_code',None) != "brand" else None
-            if text_value and row.get('entity_type', None) in ['node', None]:
-                writer.add_document(text_value=text_value,
-                                    word_bigrams=text_bigrams,
-                                    non_brand_text_value=non_brand_text,
-                                    attribute_code=row['attribute_code'],
-                                    node_id=row['entity_id'] # TODO add node_id to source table
-                                    )
-                total += 1
-    print('Writing {} records...'.format(total))
-    writer.commit()
-    print("{} elements indexed".format(total))
-    return ix
-
-
-def get_index(directory):
-    """
-    Return Whoosh index
+    A missing index is only built when `create` (default config.CREATE_INDEX_IF_MISSING)
+    is set, any other error opening it is raised as is.
     """
+    create = config.CREATE_INDEX_IF_MISSING if create is None else create
     try:
         ix = index.open_dir(directory)
-    except:
+    except index.EmptyIndexError:
+        if not create:
+            raise index.EmptyIndexError("No index in {}, build it with python main.py -b "
+                                        "or set config.CREATE_INDEX_IF_MISSING".format(directory))
         create_index(directory)
         ix = index.open_dir(directory)
     return ix
 
 
+def open_indexes(directory, build=False):
+    """
+    Return the indexes lookups search: the shard indexes of `directory` when
+    config.SHARD_BY is set, otherwise the index itself.
+
+    With `build`, missing indexes are built and so are the side structures an
+    existing index lacks, lookups only load them.
+    """
+    create = build or None
+    if config.SHARD_BY:
+        indexes = list(open_shards(directory, create=create).values())
+    else:
+        indexes = [get_index(directory, create=create)]
+    if build:
+        for ix in indexes:
+            update_sidecars(ix, missing=True)
+    return indexes
+
+
 def extract_expected(data):
     slot = ast.literal_eval(data)
     response = slot.get('response', {})
@@ -139,110 +156,549 @@ def prepare_input_sentence(sentence):
     return sentence
 
 
-def find_ngrams(l: list, n: int):
-    return list(zip(*[l[i:] for i in range(n)]))
+def token_maxdist(token):
+    return 1 if len(token) < 8 else 2
+
+
+def bigram_maxdist(bigram):
+    return 2 if len(bigram) < 8 else 3
 
 
 class MagiaSearch:
-    def __init__(self, index):
+    def __init__(self, index, shard=False):
+        """
+        With `shard` the index is one shard of a ShardedSearch, its DocStats
+        hold shard-local idf values and are not used for scoring
+        """
         self._index = index
+        self._shard = shard
         self._searcher = index.searcher
         self._schema = index.schema
+        self._idf_cache = LRUCache(config.IDF_CACHE_SIZE)
+        self._result_cache = LRUCache(config.RESULT_CACHE_SIZE, ttl=config.RESULT_CACHE_TTL)
+        self._pool = SearcherPool(index)
+        self._fuzzy_index = None  # (generation, FuzzyIndex or None)
+        self._doc_stats = None  # (generation, DocStats or None)
+        self._phrase_automaton = None  # (generation, PhraseAutomaton or None)
+        self._stored_columns = None  # (generation, StoredColumns or None)
+        self._typo_cache = TypoCache()
+        if config.TYPO_CACHE_SIZE:
+            # servers never call close(), save the typo cache when the process exits
+            atexit.register(self.save_typo_cache)
+
+    @property
+    def result_cache(self):
+        return self._result_cache
+
+    @property
+    def searcher_pool(self):
+        return self._pool
+
+    @property
+    def typo_cache(self):
+        return self._typo_cache
+
+    def refresh(self):
+        """
+        Pick up index changes on the next search of every thread
+        """
+        self._pool.refresh()
+
+    def save_typo_cache(self):
+        """
+        Save the typo cache entries of the latest index generation next to the
+        index, nothing is saved next to a read-only index
+        """
+        if not len(self._typo_cache.cache):
+            return 0
+        try:
+            return self._typo_cache.save(self._index, self._index.latest_generation())
+        except OSError:
+            return 0
+
+    def close(self):
+        atexit.unregister(self.save_typo_cache)
+        self.save_typo_cache()
+        self._pool.close()
+
+    def fuzzy_index(self, searcher):
+        """
+        Return the FuzzyIndex of the searcher's index generation, or None to expand
+        FuzzyTerms through the term dictionary
+        """
+        if not config.FUZZY_INDEX:
+            return None
+        generation = searcher.reader().generation()
+        cached = self._fuzzy_index
+        if cached is None or cached[0] != generation:
+            cached = self._fuzzy_index = (generation, get_fuzzy_index(self._index, generation))
+        return cached[1]
+
+    def doc_stats(self, searcher):
+        """
+        Return the DocStats of the searcher's index generation, or None to analyze hits at score time
+        """
+        if not config.DOC_STATS or self._shard:
+            return None
+        generation = searcher.reader().generation()
+        cached = self._doc_stats
+        if cached is None or cached[0] != generation:
+            cached = self._doc_stats = (generation, get_doc_stats(self._index, generation))
+        return cached[1]
+
+    def stored_columns(self, searcher):
+        """
+        Return the StoredColumns of the searcher's index generation, or None to read
+        hit fields through Whoosh's stored fields
+        """
+        if not config.STORED_COLUMNS:
+            return None
+        generation = searcher.reader().generation()
+        cached = self._stored_columns
+        if cached is None or cached[0] != generation:
+            cached = self._stored_columns = (generation, get_stored_columns(self._index, generation))
+        return cached[1]
+
+    def phrase_automaton(self, searcher=None):
+        """
+        Return the PhraseAutomaton of the searcher's index generation, or None if it is not available
+        """
+        searcher = searcher or self._pool.searcher()
+        generation = searcher.reader().generation()
+        cached = self._phrase_automaton
+        if cached is None or cached[0] != generation:
+            cached = self._phrase_automaton = (generation, get_phrase_automaton(self._index, generation))
+        return cached[1]
+
+    def fuzzy_expansion(self, searcher):
+        """
+        Return what build_query expands FuzzyTerms through for this searcher: the
+        typo cache in front of the FuzzyIndex, or None for the term dictionary
+        """
+        fuzzy_index = self.fuzzy_index(searcher)
+        if not config.TYPO_CACHE_SIZE:
+            return fuzzy_index
+        reader = searcher.reader()
+        self._typo_cache.load(self._index, reader.generation())
+        return self._typo_cache.resolver(reader, fuzzy_index)
+
+    def warm_typo_cache(self, filename=None, limit=None):
+        """
+        Resolve the most frequent words and bigrams of the phrase dictionary into
+        the typo cache and save it next to the index; returns the saved entry count
+        """
+        s = self._pool.searcher()
+        reader = s.reader()
+        fuzzy_index = self.fuzzy_index(s)
+        words, bigrams = dictionary_tokens(filename, limit)
+        for word in words:
+            if len(word) >= 4:
+                self._typo_cache.resolve(reader, TEXT_FIELD, word, token_maxdist(word), FIELD_PREFIXES[TEXT_FIELD],
+                                         fuzzy_index)
+        for bigram in bigrams:
+            self._typo_cache.resolve(reader, BIGRAMS_FIELD, bigram, bigram_maxdist(bigram),
+                                     FIELD_PREFIXES[BIGRAMS_FIELD], fuzzy_index)
+        return self._typo_cache.save(self._index, reader.generation())
+
+    def build_query(self, tokens, fuzzy_index=None, fuzzy_tokens=None, bigrams=None):
+        """
+        Build the boolean/fuzzy query for a list of chunk tokens.
+
+        Fuzzy terms are added for `fuzzy_tokens` and fuzzy bigrams for `bigrams`,
+        by default all tokens and all adjacent token pairs.
+        """
+        fuzzy_tokens = tokens if fuzzy_tokens is None else fuzzy_tokens
+        if bigrams is None:
+            bigrams = ['_'.join(b) for b in find_ngrams(tokens, 2)]
+        exact_and_match = And([Term(TEXT_FIELD, t) for t in tokens], boost=.5)
+        exact_or_match = Or([Term(TEXT_FIELD, t) for t in tokens], boost=.5, scale=0.9)
+        # Added variability of maxdist based on word length
+        fuzzy_or_match = Or([fuzzy_term(TEXT_FIELD, t, fuzzy_index, prefixlength=FIELD_PREFIXES[TEXT_FIELD],
+                                        maxdist=token_maxdist(t))
+                             for t in fuzzy_tokens if len(t) >= 4], boost=.2, scale=0.9)
+        if bigrams:
+            # add bigrams if there are any
+            bigram_fuzzy_or_match = Or([fuzzy_term(BIGRAMS_FIELD, b, fuzzy_index,
+                                                   prefixlength=FIELD_PREFIXES[BIGRAMS_FIELD],
+                                                  maxdist=bigram_maxdist(b)) for b in bigrams], scale=0.9)
+        else:
+            bigram_fuzzy_or_match = None
+
+
+        non_brand_or_match = Or([Term(NONBRAND_TEXT_FIELD, t) for t in tokens])
+
+
+        # q = exact_and_match \
+        # | exact_or_match \ 
+        # | fuzzy_or_match
+
+        # my_match = Or([Term(f, token) for token in tokens], boost=1)
+        # q = my_match
+
+        #
+        # q = Or([FuzzyTerm(f, token, prefixlength=2) for token in tokens if len(token) >= 3], boost=1.0,
+        #                    scale=0.9)
+
+        q = exact_and_match | exact_or_match | fuzzy_or_match  | non_brand_or_match
+
+        if bigram_fuzzy_or_match:
+            q = q | bigram_fuzzy_or_match
+
+        return q
+
+    def search_candidates(self, sentence, limit=None):
+        """
+        Return re-scored SearchResult candidates for a sentence, best first
+        """
+        tokens = sentence.split()
+        tokens = [token for token in tokens if token != REPLACED]
+        return self.search_tokens(tokens, limit=limit)
+
+    def search_tokens(self, tokens, limit=None):
+        """
+        Return re-scored SearchResult candidates for already split chunk tokens.
+
+        Results are cached by token tuple, limit and index generation, so a repeated
+        chunk skips query construction and execution.
+        """
+        limit = limit or config.SEARCH_LIMIT
+        s = self._pool.searcher()
+        key = (tuple(tokens), limit, s.reader().generation())
+        search_results = self._result_cache.get(key)
+        if search_results is not None:
+            if tracing.enabled():
+                tracing.trace('cache_hit', tokens=tokens)
+            instrumentation.count('cache_hits')
+            return search_results
+        search_results = self.run_search(s, tokens, limit)
+        self._result_cache.put(key, search_results)
+        return search_results
+
+    def run_search(self, searcher, tokens, limit):
+        """
+        Build and run the query of chunk tokens on a searcher, bypassing the result cache
+        """
+        if config.QUERY_PLANNER:
+            return self.planned_search(searcher, tokens, limit)
+        started = instrumentation.start()
+        q = self.build_query(tokens, self.fuzzy_expansion(searcher))
+        instrumentation.stop('query_build', started)
+        self.count_fuzzy_expansions(searcher, q)
+        if tracing.enabled():
+            tracing.trace('query', tokens=tokens, query=str(q))
+        return self.get_search_results(searcher, q, limit=limit)
+
+    def count_fuzzy_expansions(self, searcher, query):
+        if instrumentation.active():
+            instrumentation.count('fuzzy_expansions', sum(len(list(leaf._btexts(searcher.reader())))
+                                                          for leaf in query.leaves() if isinstance(leaf, FuzzyTerm)))
+
+    def planned_search(self, searcher, tokens, limit):
+        """
+        Run the cheapest query tier that answers the chunk tokens.
+
+        The exact tier only has the exact and non-brand clauses and answers when
+        its top hit consumes every token. Otherwise one more query adds fuzzy terms
+        for the tokens that hit left, and fuzzy bigrams touching them: the bigram
+        tier, or the fuzzy tier when no bigram touches a left token. The answering
+        tier is counted in the instrumentation counters.
+        """
+        fuzzy_index = self.fuzzy_expansion(searcher)
+        search_results = self.tier_search(searcher, tokens, limit, EXACT_TIER, fuzzy_index, [], [])
+        consumed = candidate_spans(search_results[0], tokens)[0] if search_results else set()
+        if len(consumed) == len(tokens):
+            tier = EXACT_TIER
+        else:
+            unresolved = [t for i, t in enumerate(tokens) if i not in consumed]
+            bigrams = ['_'.join(b) for b in find_ngrams(tokens, 2) if b[0] in unresolved or b[1] in unresolved]
+            tier = BIGRAM_TIER if bigrams else FUZZY_TIER
+            search_results = self.tier_search(searcher, tokens, limit, tier, fuzzy_index, unresolved, bigrams)
+        instrumentation.count(tier + '_tier')
+        if tracing.enabled():
+            tracing.trace('planner_tier', tokens=tokens, tier=tier)
+        return search_results
+
+    def tier_search(self, searcher, tokens, limit, tier, fuzzy_index, fuzzy_tokens, bigrams):
+        started = instrumentation.start()
+        q = self.build_query(tokens, fuzzy_index, fuzzy_tokens=fuzzy_tokens, bigrams=bigrams)
+        instrumentation.stop('query_build', started)
+        self.count_fuzzy_expansions(searcher, q)
+        if tracing.enabled():
+            tracing.trace('query', tokens=tokens, query=str(q), tier=tier)
+        return self.get_search_results(searcher, q, limit=limit)
 
     def perform_search(self, sentence):
-        with self._searcher() as s:
-            tokens = sentence.split()
-            tokens = [token for token in tokens if token != REPLACED]
-            print('tokens=', tokens)
-            exact_and_match = And([Term(TEXT_FIELD, t) for t in tokens], boost=.5)
-            exact_or_match = Or([Term(TEXT_FIELD, t) for t in tokens], boost=.5, scale=0.9)
-            # Added variability of maxdist based on word length
-            fuzzy_or_match = Or([FuzzyTerm(TEXT_FIELD, t, prefixlength=1, maxdist=1 if len(t) < 8 else 2)
-                                 for t in tokens if len(t) >= 4], boost=.2, scale=0.9)
-            if len(tokens) > 1:
-                # add bigrams if there are any
-                bigrams = ['_'.join(b) for b in find_ngrams(tokens, 2)]
-                bigram_fuzzy_or_match = Or([FuzzyTerm(BIGRAMS_FIELD, b, prefixlength=3,
-                                            maxdist=2 if len(b) < 8 else 3) for b in bigrams], scale=0.9)
-            else:
-                bigram_fuzzy_or_match = None
+        tokens = [token for token in sentence.split() if token != REPLACED]
+        return self.best_match(tokens)
+
+    def best_match(self, tokens):
+        search_results = self.search_tokens(tokens)
+
+        if search_results:
+            score, text, matched = search_results[0].items()
+            return text, list(set(matched))
+        else:
+            return None, None
+
+    def scoring_context(self, searcher):
+        """
+        Return a ScoringContext bound to an already open searcher
+        """
+        return ScoringContext(searcher, self._idf_cache)
+
+    def weighted_searcher(self, searcher, query, doc_stats):
+        """
+        Return a searcher on the same reader whose weighting applies the unmatched-token
+        penalty of the query inside the collector
+        """
+        weighting = UnmatchedPenaltyWeighting(searcher.weighting, doc_stats,
+                                              query_term_texts(query, searcher.reader()))
+        return Searcher(searcher.reader(), weighting=weighting, closereader=False)
+
+    def get_search_results(self, searcher, query, limit=None):
+        """
+        Return the top `limit` hits of a query as SearchResults, best first.
+
+        With config.RANKING set to "weighting" the hits are ranked by
+        UnmatchedPenaltyWeighting during the search, otherwise Whoosh's top hits
+        are re-scored afterwards, as one batch when the DocStats are available.
+        """
+        limit = limit or config.SEARCH_LIMIT
+        doc_stats = self.doc_stats(searcher)
+        native = config.RANKING == WEIGHTING and doc_stats is not None
+        started = instrumentation.start()
+        # Whoosh 2.7's block quality skipping can loop forever in AndMaybeMatcher.skip_to_quality
+        # (seen for "red" at limit 50 and the planner's exact tier at limit 20), so every hit is scored
+        if native:
+            search_results = self.weighted_searcher(searcher, query, doc_stats).search(query, terms=True, limit=limit,
+                                                                                      optimize=False)
+        else:
+            search_results = searcher.search(query, terms=True, limit=limit, optimize=False)
+        instrumentation.stop('whoosh_search', started)
+        started = instrumentation.start()
+        context = self.scoring_context(searcher)
+        columns = self.stored_columns(searcher)
+        if columns is not None:
+            hits = [(columns.text(hit.docnum), hit.matched_terms(), columns.attribute(hit.docnum))
+                    for hit in search_results]
+        else:
+            hits = [(hit[TEXT_FIELD], hit.matched_terms(), hit[ATTRIBUTE_FIELD]) for hit in search_results]
+        top_n = list(zip(search_results.items(), hits))
+        if native:
+            final_scores = [doc_score[1] for doc_score, hit in top_n]
+        elif doc_stats is not None:
+            final_scores = rescore([doc_score[1] for doc_score, hit in top_n],
+                                   [doc_stats.get(doc_score[0]) or () for doc_score, hit in top_n],
+                                   [{x[1].decode('utf-8') for x in hit[1]} for doc_score, hit in top_n])
+        else:
+            final_scores = [None] * len(top_n)
+        result = []
+        for (doc_score, hit), final_score in zip(top_n, final_scores):
+            result.append(SearchResult(initial_score=doc_score[1],
+                                       text=hit[0],
+                                       attribute=hit[2],
+                                       context=context,
+                                       matched=[x[1] for x in hit[1]],
+                                       final_score=final_score))
+        result = list(sorted(result, key=lambda x: x.score, reverse=True))
+        instrumentation.stop('rescoring', started)
+        instrumentation.count('hits_scored', len(result))
+        if tracing.enabled():
+            tracing.trace('hits', hits=[(x.text, x.score) for x in result])
 
+        return result
 
-            non_brand_or_match = Or([Term(NONBRAND_TEXT_FIELD, t) for t in tokens])
 
+class ShardPools:
+    """
+    The SearcherPools of all shards of a ShardedSearch seen as one
+    """
 
-            # q = exact_and_match \
-            # | exact_or_match \ 
-            # | fuzzy_or_match
+    def __init__(self, pools):
+        self._pools = pools
 
-            # my_match = Or([Term(f, token) for token in tokens], boost=1)
-            # q = my_match
+    @property
+    def opens(self):
+        return sum(pool.opens for pool in self._pools)
 
-            #
-            # q = Or([FuzzyTerm(f, token, prefixlength=2) for token in tokens if len(token) >= 3], boost=1.0,
-            #                    scale=0.9)
+    @property
+    def refreshes(self):
+        return sum(pool.refreshes for pool in self._pools)
 
-            q = exact_and_match | exact_or_match | fuzzy_or_match  | non_brand_or_match
+    def refresh(self):
+        for pool in self._pools:
+            pool.refresh()
 
-            if bigram_fuzzy_or_match:
-                q = q | bigram_fuzzy_or_match
+    def close(self):
+        for pool in self._pools:
+            pool.close()
 
-            print(q)
-            search_results = self.get_search_results(self._index, s, q)
 
-            for x in search_results:
-                print(x, x.score)
+class ShardedSearch:
+    """
+    Searches one MagiaSearch per index shard and merges their top hits.
 
-            if search_results:
-                score, text, matched = search_results[0].items()
-                return text, list(set(matched))
-            else:
-                return None, None
-
-    def get_search_results(self, ix, searcher, query):
-        n = 20
-        search_results = searcher.search(query, terms=True, limit=n)
-        print('top records found:')
-        top_n = list(zip(search_results.items(),
-                         [(hit[TEXT_FIELD], hit.matched_terms(), hit[ATTRIBUTE_FIELD]) for hit in search_results]))
-        result = []
-        for doc_score, hit in top_n:
-            result.append(SearchResult(initial_score=doc_score[1],
-                                       text=hit[0],
-                                       attribute=hit[2],
-                                       ix=ix,
-                                       matched=[x[1] for x in hit[1]]))
-        result = list(sorted(result, key=lambda x: x.score, reverse=True))
+    A query runs on every shard in parallel with ShardSearchers that share the
+    idf, average field length and document count of all shards, and the top
+    `limit` hits of every shard are merged by their re-scored score. Whoosh's
+    coordination bonus still counts the fuzzy expansions found in each shard, so
+    a small shard can contribute hits a single index would have cut.
 
-        return result
+    Every shard keeps its own searchers and generation-keyed structures, so
+    rebuilding one shard leaves the others' caches valid. The exact phrase
+    pre-pass is not available on shards.
+    """
 
+    def __init__(self, shards, workers=None):
+        self._shards = [MagiaSearch(ix, shard=True) for name, ix in sorted(shards.items())]
+        self._names = sorted(shards)
+        self._workers = config.SHARD_WORKERS if workers is None else workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_cache = LRUCache(config.IDF_CACHE_SIZE)
+        self._result_cache = LRUCache(config.RESULT_CACHE_SIZE, ttl=config.RESULT_CACHE_TTL)
+        self._pools = ShardPools([shard.searcher_pool for shard in self._shards])
+
+    @property
+    def shards(self):
+        return dict(zip(self._names, self._shards))
+
+    @property
+    def result_cache(self):
+        return self._result_cache
+
+    @property
+    def searcher_pool(self):
+        return self._pools
+
+    def refresh(self):
+        self._pools.refresh()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        for shard in self._shards:
+            shard.close()
+
+    def phrase_automaton(self, searcher=None):
+        return None
+
+    def warm_typo_cache(self, filename=None, limit=None):
+        return sum(shard.warm_typo_cache(filename, limit) for shard in self._shards)
+
+    def _map(self, function, *iterables):
+        if self._workers <= 1 or len(self._shards) == 1:
+            return list(map(function, *iterables))
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix='shard-search')
+        # each shard search runs in a copy of the caller's context to keep its instrumentation and traces
+        futures = [self._executor.submit(contextvars.copy_context().run, function, *args)
+                   for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def search_candidates(self, sentence, limit=None):
+        tokens = [token for token in sentence.split() if token != REPLACED]
+        return self.search_tokens(tokens, limit=limit)
+
+    def search_tokens(self, tokens, limit=None):
+        """
+        Return the re-scored SearchResult candidates of all shards for chunk tokens, best first.
+
+        The calling thread's searcher of every shard is handed to the shard worker, results
+        are cached by token tuple, limit and the generations of all shards.
+        """
+        limit = limit or config.SEARCH_LIMIT
+        searchers = [shard.searcher_pool.searcher() for shard in self._shards]
+        stats = ShardStats(searchers, self._stats_cache)
+        key = (tuple(tokens), limit, stats.generations)
+        search_results = self._result_cache.get(key)
+        if search_results is not None:
+            if tracing.enabled():
+                tracing.trace('cache_hit', tokens=tokens)
+            instrumentation.count('cache_hits')
+            return search_results
+
+        def search_shard(shard, searcher):
+            return shard.run_search(ShardSearcher(searcher, stats), tokens, limit)
+
+        shard_results = self._map(search_shard, self._shards, searchers)
+        search_results = sorted(chain.from_iterable(shard_results), key=lambda x: x.score, reverse=True)[:limit]
+        self._result_cache.put(key, search_results)
+        return search_results
 
-ix = get_index(config.INDEXDIR_PATH)  # get document index
-magia_search = MagiaSearch(ix)
+    def perform_search(self, sentence):
+        tokens = [token for token in sentence.split() if token != REPLACED]
+        return self.best_match(tokens)
 
+    def best_match(self, tokens):
+        search_results = self.search_tokens(tokens)
+        if search_results:
+            score, text, matched = search_results[0].items()
+            return text, list(set(matched))
+        return None, None
 
-def cleanup(chunk):
-    return chunk.lower()
 
+_lock = threading.Lock()
+_magia_search = None
+STARTUP_TIMINGS = {}
 
-def lookup_attributes(chunk):
-    chunk = cleanup(chunk)
 
-    attributes = []
-    while chunk:
-        attr, terms = magia_search.perform_search(chunk)
-        if not attr or attr in attributes:
-            print('No more attributes')
-            break
-        attributes.append(attr)
-        print("Current iteration result: {} ".format(attributes))
-        for word in terms:
-            # sentence = sentence.replace(word, '-------')
-            # deal with bigram words that have "_" as connector
-            for single_word in word.split("_"):
-                chunk = fuzzy_replace(single_word, REPLACED, chunk)
-        print("Tokens left: {}".format(chunk))
+def get_magia_search():
+    """
+    Return the shared MagiaSearch, opening the index on first use; a ShardedSearch
+    over the shards of INDEXDIR_PATH when config.SHARD_BY is set
+    """
+    global _magia_search
+    if _magia_search is None:
+        with _lock:
+            if _magia_search is None:
+                started = time.time()
+                if config.SHARD_BY:
+                    shards = open_shards(config.INDEXDIR_PATH)
+                    STARTUP_TIMINGS['index_open'] = time.time() - started
+                    _magia_search = ShardedSearch(shards)
+                else:
+                    ix = get_index(config.INDEXDIR_PATH)  # get document index
+                    STARTUP_TIMINGS['index_open'] = time.time() - started
+                    _magia_search = MagiaSearch(ix)
+    return _magia_search
+
+
+def reset_magia_search():
+    """
+    Forget the shared MagiaSearch so the next lookup opens the index again
+    """
+    global _magia_search, _lock
+    _magia_search = None
+    _lock = threading.Lock()
+
 
+# forked workers must not share the parent's open index files
+os.register_at_fork(after_in_child=reset_magia_search)
+
+
+def __getattr__(name):
+    # `ix` and `magia_search` used to be opened at import time
+    if name == 'magia_search':
+        return get_magia_search()
+    if name == 'ix':
+        return get_magia_search()._index
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def cleanup(chunk):
+    started = instrumentation.start()
+    chunk = remove_stopwords(chunk)
+    instrumentation.stop('stopwords', started)
+    return chunk
+
+
+def drop_nested_attributes(attributes):
+    """
+    Drop attributes that are substrings of another found attribute
+    """
     if len(attributes) > 1:
         final_result = []
         for token1 in attributes:
@@ -254,3 +710,168 @@ def lookup_attributes(chunk):
                     final_result.append(token1)
         attributes = final_result
     return list(set(attributes))
+
+
+def match_term_positions(word, tokens):
+    """
+    Return positions of chunk tokens a matched term word would replace,
+    following the same exact-then-fuzzy rules as fuzzy_replace
+    """
+    exact = [i for i, token in enumerate(tokens) if token == word]
+    if exact:
+        return exact
+    for i, token in enumerate(tokens):
+        if token_ratio(word, token) > FUZZY_RATIO:
+            return [i]
+    return []
+
+
+def candidate_spans(candidate, tokens):
+    """
+    Return (consumed, covered) chunk token positions for a candidate.
+
+    `consumed` are the positions fuzzy_replace would strip for its matched terms,
+    `covered` adds both halves of every query bigram a matched bigram term is
+    within the bigram FuzzyTerm edit distance of.
+    """
+    bigrams = ['_'.join(b) for b in find_ngrams(tokens, 2)]
+    consumed = set()
+    covered = set()
+    for word in set(candidate.matched):
+        if '_' in word:
+            for i, bigram in enumerate(bigrams):
+                if word[:3] == bigram[:3] and distance(word, bigram) <= bigram_maxdist(bigram):
+                    covered.update((i, i + 1))
+        for single_word in word.split("_"):
+            consumed.update(match_term_positions(single_word, tokens))
+    return consumed, covered | consumed
+
+
+def select_attributes(candidates, tokens, attributes):
+    """
+    Greedily pick non-overlapping candidates in score order.
+
+    Appends picked texts to `attributes` and returns the set of token positions
+    they consumed. A candidate is skipped if it touches a token already taken
+    in this pass, so every pick explains a distinct part of the chunk.
+    """
+    taken = set()
+    for candidate in candidates:
+        if len(taken) == len(tokens):
+            break
+        if candidate.text in attributes:
+            continue
+        consumed, covered = candidate_spans(candidate, tokens)
+        if covered & taken:
+            continue
+        attributes.append(candidate.text)
+        if not consumed:
+            # nothing left to strip, a further search would return the same hit
+            break
+        taken.update(consumed)
+    return taken
+
+
+def exact_phrase_prepass(tokens):
+    """
+    Split chunk tokens into the dictionary phrases occurring in them verbatim and
+    the tokens left for the fuzzy search.
+
+    Phrases of at least EXACT_PREPASS_MIN_TOKENS tokens are taken leftmost-longest
+    without overlaps.
+    """
+    automaton = get_magia_search().phrase_automaton()
+    if automaton is None:
+        return [], tokens
+    started = instrumentation.start()
+    matches = automaton.longest_matches(tokens, config.EXACT_PREPASS_MIN_TOKENS)
+    taken = {i for start, end, _ in matches for i in range(start, end)}
+    phrases = [phrase for _, _, phrase in matches]
+    tokens = [token for i, token in enumerate(tokens) if i not in taken]
+    instrumentation.stop('exact_prepass', started)
+    if tracing.enabled():
+        tracing.trace('exact_phrases', phrases=phrases, tokens_left=tokens)
+    return phrases, tokens
+
+
+def lookup_attributes_single_pass(chunk):
+    """
+    Extract several attributes per query instead of one query per attribute.
+
+    Every search picks all non-overlapping top candidates at once; only tokens
+    none of them explained are sent to a follow-up search. Results can differ
+    from the iterative mode, whose follow-up searches re-rank the remaining hits
+    without the tokens already taken.
+    """
+    chunk = cleanup(chunk)
+    tokens = [token for token in chunk.split() if token != REPLACED]
+
+    attributes = []
+    if config.EXACT_PREPASS:
+        attributes, tokens = exact_phrase_prepass(tokens)
+    while tokens:
+        candidates = get_magia_search().search_tokens(tokens, limit=config.SINGLE_PASS_CANDIDATES)
+        instrumentation.count('iterations')
+        found = len(attributes)
+        started = instrumentation.start()
+        taken = select_attributes(candidates, tokens, attributes)
+        instrumentation.stop('fuzzy_replace', started)
+        if tracing.enabled():
+            tracing.trace('pass_result', attributes=list(attributes))
+        if len(attributes) == found or not taken:
+            break
+        tokens = [token for i, token in enumerate(tokens) if i not in taken]
+        if tracing.enabled():
+            tracing.trace('tokens_left', tokens=tokens)
+
+    return drop_nested_attributes(attributes)
+
+
+def lookup_attributes(chunk, mode=None):
+    """
+    Return the attributes found in a chunk.
+
+    With config.INSTRUMENTATION on, or inside instrumentation.measure(), the
+    call records per-stage timings and counters.
+    """
+    request = instrumentation.begin()
+    if request is None:
+        return _lookup_attributes(chunk, mode)
+    try:
+        return _lookup_attributes(chunk, mode)
+    finally:
+        instrumentation.end(request)
+
+
+def _lookup_attributes(chunk, mode=None):
+    mode = mode or config.EXTRACTION_MODE
+    if mode == SINGLE_PASS:
+        return lookup_attributes_single_pass(chunk)
+
+    chunk = cleanup(chunk)
+    attributes = []
+    if config.EXACT_PREPASS:
+        attributes, tokens = exact_phrase_prepass([token for token in chunk.split() if token != REPLACED])
+        chunk = ' '.join(tokens)
+    chunk = TokenChunk(chunk)
+
+    while chunk:
+        instrumentation.count('iterations')
+        attr, terms = get_magia_search().best_match(chunk.remaining())
+        if not attr or attr in attributes:
+            if tracing.enabled():
+                tracing.trace('no_more_attributes')
+            break
+        attributes.append(attr)
+        if tracing.enabled():
+            tracing.trace('iteration_result', attributes=list(attributes))
+        started = instrumentation.start()
+        for word in terms:
+            # deal with bigram words that have "_" as connector
+            for single_word in word.split("_"):
+                chunk.replace(single_word)
+        instrumentation.stop('fuzzy_replace', started)
+        if tracing.enabled():
+            tracing.trace('tokens_left', tokens=chunk.remaining())
+
+    return drop_nested_attributes(attributes)
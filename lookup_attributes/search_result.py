@@ -3,6 +3,7 @@ from collections import Counter
 
 from .field_names import TEXT_FIELD
 from .schema import analyzer
+from . import tracing
 
 # from .stopwords import STOPWORDS
 STOPWORDS = []
@@ -16,14 +17,15 @@ def compute_tf(text):
 
 
 class SearchResult:
-    def __init__(self, text, attribute, matched, ix, initial_score=0):
+    def __init__(self, text, attribute, matched, context, initial_score=0, final_score=None):
         self._text = text
         self._attribute = attribute
         self._matched = matched
         self._initial_score = initial_score
-        self._ix = ix
-        self._tf = compute_tf(self.tokens)
-        self._score = self._calculate_score()
+        self._context = context
+        self._tf = None
+        # final_score: already computed for the whole batch of hits from DocStats, see rescoring
+        self._score = self._calculate_score() if final_score is None else final_score
 
     def __str__(self):
         return self.text
@@ -47,16 +49,14 @@ class SearchResult:
     def matched(self):
         return [m.decode('utf-8') for m in self._matched]
 
-    def idf(self, searcher, text):
+    def idf(self, text):
         """Returns the inverse document frequency of the given term.
         """
-        from math import log
-        parent = searcher.get_parent()
-        n = parent.doc_frequency(TEXT_FIELD, text)
-        dc = parent.doc_count_all()
-        return log(dc / (n + 1)) + 1
+        return self._context.idf(text, TEXT_FIELD)
 
     def tf(self, token):
+        if self._tf is None:
+            self._tf = compute_tf(self.tokens)
         return self._tf[token]
 
     def _calculate_score(self):
@@ -68,13 +68,11 @@ class SearchResult:
         not_matched_tokens = list(set([token for token in self.tokens if token not in self.matched]))
 
         # print("not_matched_tokens=", not_matched_tokens)
-        with self._ix.searcher() as s:
-            # sum_not_matched = sum([s.frequency(self._field_name, token) for token in not_matched_tokens])
-            # sum_not_matched = sum([self.tf(token)*self.idf(s, token) for token in not_matched_tokens])
+        # sum_not_matched = sum([s.frequency(self._field_name, token) for token in not_matched_tokens])
 
-            # currently have to divide by len(doc_word_list) because not all tokens are showing
-            # doc_word_list = set(str(self).replace('-', ' ').split())
-            sum_not_matched = sum([self.tf(token) * self.idf(s, token) for token in not_matched_tokens])
+        # currently have to divide by len(doc_word_list) because not all tokens are showing
+        # doc_word_list = set(str(self).replace('-', ' ').split())
+        sum_not_matched = sum([self.tf(token) * self.idf(token) for token in not_matched_tokens])
 
         # base_bonus = 1 if self._attribute == 'brand' else 2
         base_bonus = 1
@@ -83,8 +81,9 @@ class SearchResult:
             # score -= sum_not_matched / len(not_matched_tokens)
             score -= sum_not_matched
 
-        print(str(self), "  self.tokens=", self.tokens, " initial=", self._initial_score, " sum_not_matches=",
-              sum_not_matched, " score=", score)
+        if tracing.enabled():
+            tracing.trace('score', text=self.text, tokens=self.tokens, initial=self._initial_score,
+                          sum_not_matched=sum_not_matched, score=score)
         # return score * -1
         return score
 
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import config
+
+
+class SearcherPool:
+    """
+    One long-lived searcher per thread.
+
+    Searchers are kept open between searches and only refreshed when the index
+    generation changed, checked at most every `refresh_interval` seconds.
+    """
+
+    def __init__(self, index, refresh_interval=None):
+        self._index = index
+        self._refresh_interval = config.SEARCHER_REFRESH_INTERVAL if refresh_interval is None else refresh_interval
+        self._local = threading.local()
+        self._searchers = {}  # thread -> searcher, to close them all
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.opens = 0
+        self.refreshes = 0
+
+    def searcher(self):
+        """
+        Return this thread's searcher, opening or refreshing it when needed
+        """
+        local = self._local
+        s = getattr(local, 'searcher', None)
+        if s is None:
+            return self._open()
+        now = time.time()
+        if local.epoch != self._epoch or now - local.checked >= self._refresh_interval:
+            local.checked = now
+            local.epoch = self._epoch
+            if not s.up_to_date():
+                s = local.searcher = s.refresh()
+                with self._lock:
+                    # refresh() already closed what the new searcher does not reuse
+                    self._searchers[threading.current_thread()] = s
+                    self.refreshes += 1
+        return s
+
+    def _open(self):
+        s = self._index.searcher()
+        local = self._local
+        local.searcher = s
+        local.checked = time.time()
+        local.epoch = self._epoch
+        with self._lock:
+            self._close_dead_threads()
+            # keyed by the thread object, idents of finished threads are reused
+            old = self._searchers.pop(threading.current_thread(), None)
+            if old is not None:
+                old.close()
+            self._searchers[threading.current_thread()] = s
+            self.opens += 1
+        return s
+
+    def _close_dead_threads(self):
+        for thread in [t for t in self._searchers if not t.is_alive()]:
+            self._searchers.pop(thread).close()
+
+    def refresh(self):
+        """
+        Make every thread check the index generation on its next search
+        """
+        self._epoch += 1
+
+    def close(self):
+        with self._lock:
+            for s in self._searchers.values():
+                s.close()
+            self._searchers.clear()
+            self._local = threading.local()
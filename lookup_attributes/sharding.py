@@ -0,0 +1,155 @@
+import os
+import re
+import zlib
+
+import whoosh.index as index
+from whoosh.searching import Searcher
+
+import config
+from .field_names import ATTRIBUTE_FIELD, NODE_ID_FIELD
+from .indexing import build_index, document_from_row, iter_dictionary_rows, sync_index
+
+ATTRIBUTE = 'attribute'
+HASH = 'hash'
+
+
+def shards_dir(directory):
+    """
+    Return the directory holding one index directory per shard of `directory`
+    """
+    return os.path.normpath(directory) + '.shards'
+
+
+def shard_name(document, shard_by=None, shard_count=None):
+    """
+    Return the name of the shard an index document belongs to
+    """
+    shard_by = shard_by or config.SHARD_BY
+    if shard_by == ATTRIBUTE:
+        return re.sub(r'[^\w.-]', '_', document[ATTRIBUTE_FIELD] or '') or '_'
+    if shard_by == HASH:
+        # crc32 rather than hash() so every process puts a node id in the same shard
+        count = shard_count or config.SHARD_COUNT
+        return '{:02d}'.format(zlib.crc32(document[NODE_ID_FIELD].encode('utf-8')) % count)
+    raise ValueError("Unknown SHARD_BY {!r}, use {!r} or {!r}".format(shard_by, ATTRIBUTE, HASH))
+
+
+def shard_filter(name):
+    return lambda document: shard_name(document) == name
+
+
+def source_shard_names(filename=None):
+    """
+    Return the names of the shards the dictionary CSV documents fall into
+    """
+    names = set()
+    for row in iter_dictionary_rows(filename or config.DOMAIN_DICTIONARY_CSV):
+        document = document_from_row(row)
+        if document is not None:
+            names.add(shard_name(document))
+    return names
+
+
+def build_shard(directory, name, filename=None, **options):
+    """
+    Build the index of one shard from the dictionary CSV documents that belong to it.
+    Other shards and their caches are left as they are. A new index restarts its
+    generations, so running processes only see the rebuilt shard once they reopen it.
+    Returns the index and an IndexBuildStats.
+    """
+    return build_index(os.path.join(shards_dir(directory), name), filename, document_filter=shard_filter(name),
+                       **options)
+
+
+def build_shards(directory, filename=None, **options):
+    """
+    Build every shard of the dictionary CSV, returns {shard name: index}
+    """
+    return {name: build_shard(directory, name, filename, **options)[0]
+            for name in sorted(source_shard_names(filename))}
+
+
+def open_shards(directory, create=None):
+    """
+    Return {shard name: index} for the shard indexes of `directory`.
+
+    Missing shards are only built when `create` (default config.CREATE_INDEX_IF_MISSING) is set.
+    """
+    create = config.CREATE_INDEX_IF_MISSING if create is None else create
+    root = shards_dir(directory)
+    names = sorted(name for name in os.listdir(root)
+                   if index.exists_in(os.path.join(root, name))) if os.path.isdir(root) else []
+    if not names:
+        if not create:
+            raise index.EmptyIndexError("No index shards in {}, build them with python main.py -b "
+                                        "or set config.CREATE_INDEX_IF_MISSING".format(root))
+        return build_shards(directory)
+    return {name: index.open_dir(os.path.join(root, name)) for name in names}
+
+
+def sync_shards(directory, filename=None, **options):
+    """
+    Apply dictionary CSV changes to every shard; shards new in the source are built.
+    Returns {shard name: IndexSyncStats or IndexBuildStats}.
+    """
+    shards = open_shards(directory, create=False)
+    stats = {}
+    for name in sorted(source_shard_names(filename) | set(shards)):
+        if name in shards:
+            stats[name] = sync_index(shards[name], filename, document_filter=shard_filter(name), **options)
+        else:
+            stats[name] = build_shard(directory, name, filename)[1]
+    return stats
+
+
+class ShardStats:
+    """
+    Document counts, document frequencies and field lengths summed over one
+    searcher per shard, so every shard scores with the statistics of the whole dictionary.
+
+    Document frequencies are memoized in `cache` keyed by the shard generations.
+    """
+
+    def __init__(self, searchers, cache):
+        self._readers = [s.reader() for s in searchers]
+        self.generations = tuple(reader.generation() for reader in self._readers)
+        self._cache = cache
+        self._field_lengths = {}
+        self.doc_count = sum(reader.doc_count_all() for reader in self._readers)
+
+    def doc_frequency(self, fieldname, text):
+        key = (self.generations, fieldname, text)
+        n = self._cache.get(key)
+        if n is None:
+            n = sum(reader.doc_frequency(fieldname, text) for reader in self._readers)
+            self._cache.put(key, n)
+        return n
+
+    def field_length(self, fieldname):
+        length = self._field_lengths.get(fieldname)
+        if length is None:
+            length = self._field_lengths[fieldname] = sum(reader.field_length(fieldname)
+                                                          for reader in self._readers)
+        return length
+
+
+class ShardSearcher(Searcher):
+    """
+    Searcher on the reader of one shard whose idf, average field length and
+    document count come from ShardStats, so hits of different shards compare by score
+    """
+
+    def __init__(self, searcher, stats):
+        Searcher.__init__(self, searcher.reader(), weighting=searcher.weighting, closereader=False)
+        self.stats = stats
+        self.generations = stats.generations
+        # Searcher copies doc_frequency from the reader, BM25F reads it through get_parent()
+        self.doc_frequency = stats.doc_frequency
+        self._doccount = stats.doc_count
+
+    def _subsearcher(self, reader):
+        # segment searchers take their statistics from this searcher as their parent
+        return Searcher(reader, fromindex=self._ix, weighting=self.weighting, parent=self)
+
+    def field_length(self, fieldname):
+        return self.stats.field_length(fieldname)
@@ -0,0 +1,99 @@
+import glob
+import os
+import pickle
+import shutil
+import threading
+
+
+def sidecar_dir(ix):
+    """
+    Return the directory next to the index directory that holds derived structures
+    """
+    return os.path.abspath(ix.storage.folder) + '.sidecar'
+
+
+def remove_sidecars(ix):
+    """
+    Remove all structures saved next to an index, a new index restarts its generations at 0
+    """
+    shutil.rmtree(sidecar_dir(ix), ignore_errors=True)
+
+
+def sidecar_path(ix, name, generation, suffix='.pickle'):
+    return os.path.join(sidecar_dir(ix), '{}_{}{}'.format(name, generation, suffix))
+
+
+def load_sidecar(ix, name, generation):
+    """
+    Return the structure saved for this index generation, or None if there is none
+    """
+    try:
+        with open(sidecar_path(ix, name, generation), 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def save_sidecar(ix, name, generation, obj):
+    """
+    Save a structure derived from one index generation and drop older generations of it
+    """
+    return write_sidecar(ix, name, generation,
+                         lambda f: pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def write_sidecar(ix, name, generation, write, suffix='.pickle'):
+    """
+    Create the sidecar file of an index generation with `write(file)` and drop
+    older generations of it, newer ones saved meanwhile are kept
+    """
+    path = sidecar_path(ix, name, generation, suffix)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so readers never see a partial file
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        write(f)
+    os.replace(temp_path, path)
+    for old_generation in saved_generations(ix, name, suffix):
+        if old_generation < generation:
+            try:
+                os.remove(sidecar_path(ix, name, old_generation, suffix))
+            except OSError:
+                pass
+    return path
+
+
+def saved_generations(ix, name, suffix='.pickle'):
+    """
+    Return the sorted index generations a structure is saved for
+    """
+    generations = []
+    for path in glob.glob(os.path.join(sidecar_dir(ix), '{}_*{}'.format(name, suffix))):
+        generation = os.path.basename(path)[len(name) + 1:-len(suffix)]
+        if generation.isdigit():
+            generations.append(int(generation))
+    return sorted(generations)
+
+
+_build_lock = threading.Lock()
+
+
+def get_sidecar(ix, name, generation, build=None, load=load_sidecar):
+    """
+    Return the structure saved for an index generation, read with
+    `load(ix, name, generation)`. When it is missing and the generation is still
+    the latest, `build(ix)` builds and saves it first; returns None if it is not
+    available, also when it cannot be written next to a read-only index.
+    """
+    obj = load(ix, name, generation)
+    if obj is None and build is not None:
+        with _build_lock:
+            obj = load(ix, name, generation)
+            if obj is None and ix.latest_generation() == generation:
+                try:
+                    obj = build(ix)
+                except OSError:
+                    return None
+    if obj is not None and obj.generation != generation:
+        return None
+    return obj
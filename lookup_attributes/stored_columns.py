@@ -0,0 +1,139 @@
+import json
+import mmap
+import struct
+from array import array
+
+from .field_names import TEXT_FIELD, ATTRIBUTE_FIELD, NODE_ID_FIELD
+from .sidecar import get_sidecar, sidecar_path, write_sidecar
+
+SIDECAR_NAME = 'stored_columns'
+SUFFIX = '.bin'
+
+MAGIC = b'MGCOLS01'
+# magic, generation, doc count, attribute table length, text blob length, node id blob length;
+# the offset and attribute id arrays that follow are in native byte order
+HEADER = struct.Struct('=8sqqqqq')
+NO_ATTRIBUTE = 0xFFFF
+
+
+class StoredColumns:
+    """
+    Memory-mapped text_value, attribute_code and node_id columns of one index generation.
+
+    Texts and node ids are UTF-8 blobs addressed by per-document offsets and
+    attribute codes are indexes into a small table, so reading a hit's fields
+    by docnum needs no unpickling and processes share the file through the
+    page cache.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.generation, self.doc_count, table_length, text_length,
+         node_length) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a stored columns file".format(path))
+        position = HEADER.size
+        self._attributes = json.loads(self._mmap[position:position + table_length].decode('utf-8'))
+        position += _padded(table_length)
+        view = memoryview(self._mmap)
+        self._text_offsets = view[position:position + 8 * (self.doc_count + 1)].cast('Q')
+        position += 8 * (self.doc_count + 1)
+        self._node_offsets = view[position:position + 8 * (self.doc_count + 1)].cast('Q')
+        position += 8 * (self.doc_count + 1)
+        self._attribute_ids = view[position:position + 2 * self.doc_count].cast('H')
+        position += _padded(2 * self.doc_count)
+        self._texts = position
+        self._node_ids = position + _padded(text_length)
+
+    def __len__(self):
+        return self.doc_count
+
+    def text(self, docnum):
+        start, end = self._text_offsets[docnum], self._text_offsets[docnum + 1]
+        return self._mmap[self._texts + start:self._texts + end].decode('utf-8')
+
+    def attribute(self, docnum):
+        attribute_id = self._attribute_ids[docnum]
+        return None if attribute_id == NO_ATTRIBUTE else self._attributes[attribute_id]
+
+    def node_id(self, docnum):
+        start, end = self._node_offsets[docnum], self._node_offsets[docnum + 1]
+        return self._mmap[self._node_ids + start:self._node_ids + end].decode('utf-8')
+
+
+def _padded(length):
+    return (length + 7) // 8 * 8
+
+
+def write_stored_columns(f, generation, documents):
+    """
+    Write the columns of (text_value, attribute_code, node_id) per docnum to a binary file
+    """
+    attributes = {}
+    attribute_ids = []
+    texts = []
+    node_ids = []
+    for text, attribute, node_id in documents:
+        texts.append((text or '').encode('utf-8'))
+        node_ids.append((node_id or '').encode('utf-8'))
+        if attribute is None:
+            attribute_ids.append(NO_ATTRIBUTE)
+        else:
+            attribute_ids.append(attributes.setdefault(attribute, len(attributes)))
+    if len(attributes) >= NO_ATTRIBUTE:
+        raise ValueError("Too many distinct attribute codes for the stored columns: {}".format(len(attributes)))
+    table = json.dumps(sorted(attributes, key=attributes.get)).encode('utf-8')
+    text_blob = b''.join(texts)
+    node_blob = b''.join(node_ids)
+
+    def offsets(values):
+        result = array('Q', [0])
+        for value in values:
+            result.append(result[-1] + len(value))
+        return result.tobytes()
+
+    def pad(length):
+        f.write(b'\0' * (_padded(length) - length))
+
+    f.write(HEADER.pack(MAGIC, generation, len(texts), len(table), len(text_blob), len(node_blob)))
+    f.write(table)
+    pad(len(table))
+    f.write(offsets(texts))
+    f.write(offsets(node_ids))
+    f.write(array('H', attribute_ids).tobytes())
+    pad(2 * len(attribute_ids))
+    f.write(text_blob)
+    pad(len(text_blob))
+    f.write(node_blob)
+
+
+def build_stored_columns(ix):
+    """
+    Write the StoredColumns of the latest index generation next to the index and open them
+    """
+    with ix.searcher() as s:
+        reader = s.reader()
+        generation = reader.generation()
+        documents = [(None, None, None)] * reader.doc_count_all()
+        for docnum, fields in reader.iter_docs():
+            documents[docnum] = (fields.get(TEXT_FIELD), fields.get(ATTRIBUTE_FIELD), fields.get(NODE_ID_FIELD))
+    path = write_sidecar(ix, SIDECAR_NAME, generation, lambda f: write_stored_columns(f, generation, documents),
+                         suffix=SUFFIX)
+    return StoredColumns(path)
+
+
+def load_stored_columns(ix, name, generation):
+    try:
+        return StoredColumns(sidecar_path(ix, name, generation, SUFFIX))
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def get_stored_columns(ix, generation, build=False):
+    """
+    Return the StoredColumns of an index generation, building them when missing
+    and `build` is set; None if they are not available
+    """
+    return get_sidecar(ix, SIDECAR_NAME, generation, build_stored_columns if build else None,
+                       load=load_stored_columns)
@@ -0,0 +1,111 @@
+import re
+
+from Levenshtein import ratio as levenshtein_ratio
+
+REPLACED = '------'
+FUZZY_RATIO = 74
+
+_patterns = {}
+_PLAIN_WORD = re.compile(r'\w+$')
+
+
+def token_ratio(str_a, str_b, threshold=FUZZY_RATIO):
+    """
+    Return fuzz.ratio(str_a, str_b), or 0 as soon as it cannot exceed threshold.
+
+    fuzz.ratio is round(200 * LCS / (len_a + len_b)) and the LCS is at most the
+    shorter length, so unequal lengths alone often rule a pair out.
+    """
+    len_a = len(str_a)
+    len_b = len(str_b)
+    if not len_a or not len_b:
+        return 0
+    if int(round(200.0 * min(len_a, len_b) / (len_a + len_b))) <= threshold:
+        return 0
+    return int(round(100 * levenshtein_ratio(str_a, str_b)))
+
+
+def _word_pattern(word):
+    pattern = _patterns.get(word)
+    if pattern is None:
+        pattern = _patterns[word] = re.compile(r"\b{}\b".format(word))
+    return pattern
+
+
+class TokenChunk:
+    """
+    Chunk tokens with a consumed mask.
+
+    Mirrors what repeated fuzzy_replace calls do to a chunk string, but the chunk
+    is tokenized once and replaced tokens are only flagged, not re-joined.
+    """
+
+    def __init__(self, chunk, stub=REPLACED):
+        self._stub = stub
+        self._empty = not chunk
+        self._tokens = chunk.split()
+        self._consumed = [token == stub for token in self._tokens]
+
+    def __bool__(self):
+        # fuzzy_replace never empties a non-empty chunk string
+        return not self._empty
+
+    def __str__(self):
+        return " ".join(self._stub if used else token for token, used in zip(self._tokens, self._consumed))
+
+    def remaining(self):
+        """
+        Return tokens not replaced yet, in chunk order
+        """
+        return [token for token, used in zip(self._tokens, self._consumed) if not used]
+
+    def replace(self, word, ratio=FUZZY_RATIO):
+        """
+        Consume the chunk token(s) matching a single-word term.
+
+        If the word occurs anywhere in the chunk every whole-word occurrence is
+        replaced, otherwise the first remaining token with fuzz.ratio above
+        `ratio` is consumed. Returns True if the chunk changed.
+        """
+        if not word:
+            return False
+        tokens = self._tokens
+        consumed = self._consumed
+        hits = [i for i, token in enumerate(tokens) if word in token and not consumed[i]]
+        if hits:
+            if not _PLAIN_WORD.match(word):
+                # the term is used as a regex and may match across tokens
+                return self._replace_pattern(word)
+            changed = False
+            for i in hits:
+                token = tokens[i]
+                if token == word:
+                    consumed[i] = True
+                    changed = True
+                    continue
+                replaced = _word_pattern(word).sub(self._stub, token)
+                if replaced != token:
+                    tokens[i] = replaced
+                    changed = True
+            return changed
+        len_word = len(word)
+        for i, token in enumerate(tokens):
+            if consumed[i]:
+                continue
+            len_token = len(token)
+            # cheap upper bound of the ratio before computing it
+            if int(round(200.0 * min(len_word, len_token) / (len_word + len_token))) <= ratio:
+                continue
+            if int(round(100 * levenshtein_ratio(word, token))) > ratio:
+                consumed[i] = True
+                return True
+        return False
+
+    def _replace_pattern(self, word):
+        before = str(self)
+        after = _word_pattern(word).sub(self._stub, before)
+        if after == before:
+            return False
+        self._tokens = after.split()
+        self._consumed = [token == self._stub for token in self._tokens]
+        return True
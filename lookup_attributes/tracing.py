@@ -0,0 +1,45 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger('lookup_attributes')
+
+_captured = ContextVar('lookup_attributes_trace', default=None)
+
+
+def enabled():
+    """
+    Return True if trace events are captured or DEBUG logging is on
+    """
+    return _captured.get() is not None or logger.isEnabledFor(logging.DEBUG)
+
+
+def trace(event, **fields):
+    """
+    Record one trace event with its fields.
+
+    Events go to the `lookup_attributes` logger at DEBUG level and, inside a
+    capture() block, into that block's list. Callers check enabled() before
+    building the fields, so tracing costs one check when nobody listens.
+    """
+    events = _captured.get()
+    if events is not None:
+        events.append(dict(fields, event=event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s %s", event, fields, extra={'trace_event': event, 'trace_fields': fields})
+
+
+@contextmanager
+def capture():
+    """
+    Collect the trace events of the enclosed lookups into a list::
+
+        with capture() as events:
+            lookup_attributes(chunk)
+    """
+    events = []
+    token = _captured.set(events)
+    try:
+        yield events
+    finally:
+        _captured.reset(token)
@@ -0,0 +1,119 @@
+from collections import Counter
+
+from Levenshtein import distance
+
+import config
+from .cache import LRUCache
+from .fuzzy_index import leaf_terms_within
+from .sidecar import load_sidecar, save_sidecar, saved_generations
+
+SIDECAR_NAME = 'typo_cache'
+
+
+class TypoCache:
+    """
+    Memo of fuzzy token resolutions shared by all searches.
+
+    Maps (field, token, maxdist, prefix, generation) to the index terms the token
+    expands to with their edit distances, so a repeated typo skips the fuzzy
+    expansion. Entries of one generation can be saved next to the index and
+    loaded again after a restart.
+    """
+
+    def __init__(self, maxsize=None):
+        self._cache = LRUCache(config.TYPO_CACHE_SIZE if maxsize is None else maxsize)
+        self._loaded = set()
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def resolve(self, reader, fieldname, text, maxdist, prefix, fuzzy_index=None):
+        """
+        Return ((term, distance), ...) for the terms within `maxdist` edits of text
+        """
+        key = (fieldname, text, maxdist, prefix, reader.generation())
+        corrections = self._cache.get(key)
+        if corrections is None:
+            terms = None
+            if fuzzy_index is not None:
+                terms = fuzzy_index.terms_within(fieldname, text, maxdist, prefix)
+            if terms is None:
+                terms = leaf_terms_within(reader, fieldname, text, maxdist, prefix)
+            corrections = tuple((term, distance(text, term)) for term in terms)
+            self._cache.put(key, corrections)
+        return corrections
+
+    def resolver(self, reader, fuzzy_index=None):
+        return TypoResolver(self, reader, fuzzy_index)
+
+    def load(self, ix, generation):
+        """
+        Add the entries saved for an index generation, once per generation
+        """
+        if generation in self._loaded:
+            return 0
+        self._loaded.add(generation)
+        entries = load_sidecar(ix, SIDECAR_NAME, generation) or {}
+        for (fieldname, text, maxdist, prefix), corrections in entries.items():
+            self._cache.put((fieldname, text, maxdist, prefix, generation), corrections)
+        return len(entries)
+
+    def save(self, ix, generation):
+        """
+        Save the entries of an index generation next to the index, merged into
+        the ones already saved for it
+        """
+        entries = load_sidecar(ix, SIDECAR_NAME, generation) or {}
+        entries.update((key[:4], corrections) for key, corrections in self._cache.items() if key[4] == generation)
+        save_sidecar(ix, SIDECAR_NAME, generation, entries)
+        return len(entries)
+
+    def carry_over(self, ix, reader, fuzzy_index=None):
+        """
+        Resolve the tokens saved for the previous index generation again against
+        the reader's generation and save them for it, so an index change keeps
+        the cache warm; returns the saved entry count
+        """
+        generation = reader.generation()
+        previous = [g for g in saved_generations(ix, SIDECAR_NAME) if g < generation]
+        if not previous:
+            return 0
+        entries = load_sidecar(ix, SIDECAR_NAME, previous[-1]) or {}
+        for fieldname, text, maxdist, prefix in entries:
+            self.resolve(reader, fieldname, text, maxdist, prefix, fuzzy_index)
+        return self.save(ix, generation)
+
+
+class TypoResolver:
+    """
+    Expands FuzzyTerms of one search through a TypoCache
+    """
+
+    def __init__(self, typo_cache, reader, fuzzy_index=None):
+        self._typo_cache = typo_cache
+        self._reader = reader
+        self._fuzzy_index = fuzzy_index
+
+    def __deepcopy__(self, memo):
+        # Whoosh deep copies queries while normalizing them
+        return self
+
+    def terms_within(self, fieldname, text, maxdist, prefix=0):
+        corrections = self._typo_cache.resolve(self._reader, fieldname, text, maxdist, prefix, self._fuzzy_index)
+        return [term for term, _ in corrections]
+
+
+def dictionary_tokens(filename=None, limit=None):
+    """
+    Return the `limit` most frequent words and word bigrams of the phrase dictionary
+    """
+    words = Counter()
+    bigrams = Counter()
+    with open(filename or config.DICTIONARY_FILENAME, 'r') as f:
+        for line in f:
+            tokens = line.lower().split()
+            words.update(tokens)
+            bigrams.update('_'.join(b) for b in zip(tokens, tokens[1:]))
+    limit = config.TYPO_CACHE_WARM if limit is None else limit
+    return [w for w, _ in words.most_common(limit)], [b for b, _ in bigrams.most_common(limit)]
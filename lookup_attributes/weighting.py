@@ -0,0 +1,48 @@
+from whoosh import scoring
+from whoosh.query.terms import MultiTerm
+
+
+def query_term_texts(query, reader):
+    """
+    Return the texts of all terms a query can match, with multi-term queries
+    like FuzzyTerm expanded against reader
+    """
+    texts = set()
+    for leaf in query.leaves():
+        if isinstance(leaf, MultiTerm):
+            texts.update(leaf._btexts(reader))
+        elif hasattr(leaf, 'text'):
+            texts.add(leaf.text)
+    return frozenset(t.decode('utf-8') if isinstance(t, bytes) else t for t in texts)
+
+
+class UnmatchedPenaltyWeighting(scoring.WeightingModel):
+    """
+    Scores terms with a base weighting model and subtracts the SearchResult
+    unmatched-token penalty from every matching document in final().
+
+    A document token counts as matched when the query has a term with its text,
+    so ranking and the top `limit` cut happen once inside the collector.
+    Penalties come from the DocStats weights of the searched index generation.
+    """
+
+    use_final = True
+
+    def __init__(self, base, doc_stats, term_texts):
+        self.base = base
+        self.doc_stats = doc_stats
+        self.term_texts = term_texts
+
+    def idf(self, searcher, fieldname, text):
+        return self.base.idf(searcher, fieldname, text)
+
+    def scorer(self, searcher, fieldname, text, qf=1):
+        return self.base.scorer(searcher, fieldname, text, qf=qf)
+
+    def final(self, searcher, docnum, score):
+        if self.base.use_final:
+            score = self.base.final(searcher, docnum, score)
+        weights = self.doc_stats.get(docnum)
+        if weights:
+            score -= sum(weight for token, weight in weights if token not in self.term_texts)
+        return score
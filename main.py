@@ -1,17 +1,20 @@
 #!/usr/bin/env python
+import logging
 import sys
-import re
 from datetime import datetime
 
 from colorama import Fore, Back, Style, init as colorama_init
 from whoosh import scoring
+from whoosh.index import EmptyIndexError
 from whoosh.qparser import QueryParser, FuzzyTermPlugin
 from whoosh.query import Query
 
-from lookup_attributes import lookup_attributes, magia_search
+import config
+from data import REGRESSION_SET
+from lookup_attributes import lookup_attributes, get_index, get_magia_search, open_indexes
 from lookup_attributes.field_names import TEXT_FIELD
-from lookup_attributes.search import ix
-from lookup_attributes.stopwords import STOPWORDS
+from lookup_attributes.indexing import sync_index
+from lookup_attributes.sharding import build_shard, sync_shards
 
 colorama_init()
 
@@ -22,49 +25,60 @@ def cprint(msg, foreground="black", background="white"):
     style = getattr(Fore, fground) + getattr(Back, bground)
     print(style + msg + Style.RESET_ALL)
 
-def remove_stopwords(sentence):
-    sentence = sentence.strip().lower()
-    for word in STOPWORDS:
-        sentence = re.sub(r'\b' + word + r'\b', '', sentence)
-    return sentence
 
 
+def main(query: ("Query", 'option', 'q'),
+         mode: ("Extraction mode: iterative or single_pass", 'option', 'm')=None,
+         sync: ("Apply domain dictionary changes to the index and exit", 'flag', 's')=False,
+         build: ("Build the index from the domain dictionary if it does not exist, and missing side structures",
+                 'flag', 'b')=False,
+         verbose: ("Log search traces", 'flag', 'v')=False,
+         warm: ("Warm the typo cache from the phrase dictionary and exit", 'flag', 'w')=False,
+         rebuild: ("Rebuild one index shard and exit", 'option', 'r')=None,
+         arg_sentence=None, ):
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.WARNING, format='%(message)s')
+
+    if rebuild:
+        build_shard(config.INDEXDIR_PATH, rebuild)
+        sys.exit()
+
+    if sync:
+        if config.SHARD_BY:
+            sync_shards(config.INDEXDIR_PATH)
+        else:
+            sync_index(get_index(config.INDEXDIR_PATH))
+        sys.exit()
+
+    try:
+        open_indexes(config.INDEXDIR_PATH, build=build)
+    except EmptyIndexError as e:
+        sys.exit(str(e))
+    magia_search = get_magia_search()
+
+    if warm:
+        print('{} typo cache entries saved'.format(magia_search.warm_typo_cache()))
+        sys.exit()
 
-def main(query: ("Query", 'option', 'q'), arg_sentence=None, ):
     # test_data = SENTENCES
     # test_data = get_test_data(config.TEST_DATA_CSV)
     if arg_sentence:
         test_data = [(arg_sentence, [])]
     else:
-        test_data = [
-            # ("Do you have something like the 2005 Zinfandel of Turley?".lower(), []),
-            ("redd wine nappa chateau latoor", []),
-            ("nappa valley", ['napa valley']),
-            ("latour", ['chateau latour']),
-            ("red chateu latour", ['red', 'chateau latour']),
-            ("red", ['red']),
-            ("red chateau lator", ['red', 'chateau latour']),
-            ("cabernet sauvignon", ['cabernet sauvignon']),
-            ("caubernet sauvignon", ['cabernet sauvignon']),
-            ("cabernet savignon", ['cabernet sauvignon']),
-            ("caubernet sauvignon", ['cabernet sauvignon']),
-            ("how are yoou", []),
-            ("chateu meru lator", ['merus', 'chateau latour']),
-            ("chateau lator", ['chateau latour']),
-            ("blak opul", ['black opal']),
-            ("red caubernet sauvignon", ['red', 'cabernet sauvignon'])
-        ]
+        test_data = REGRESSION_SET
     print()
     print()
     success = 0
     total = len(test_data)
 
     if query:
+        if config.SHARD_BY:
+            sys.exit("-q runs a raw query on a single index, it is not available with config.SHARD_BY set")
         with magia_search._searcher(weighting=scoring.TF_IDF()) as s:
             qp = QueryParser(TEXT_FIELD, schema=magia_search._schema)
             qp.add_plugin(FuzzyTermPlugin)
             q = qp.parse(query)
-            magia_search.get_search_results(ix, s, q)
+            for x in magia_search.get_search_results(s, q):
+                print(x, x.score)
             sys.exit()
 
     failed = []
@@ -72,7 +86,7 @@ def main(query: ("Query", 'option', 'q'), arg_sentence=None, ):
         orig_chunk = chunk
         print("Input chunk: {}".format(chunk))
         start_time = datetime.now()
-        result = lookup_attributes(remove_stopwords(chunk))
+        result = lookup_attributes(chunk, mode=mode)
 
         if sorted(result) == sorted(expected):
             success += 1
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+from lookup_attributes import lookup_attributes, get_magia_search, open_indexes
+from lookup_attributes import instrumentation
+from lookup_attributes.metrics import Histogram
+
+BATCH_SIZE_BOUNDS = tuple(2 ** i for i in range(10))
+
+
+class MicroBatcher:
+    """
+    Collects lookups from concurrent requests and runs them in batches.
+
+    A batch is closed after `window` seconds or `max_batch` chunks; identical chunks
+    in a batch are looked up once and the distinct ones run on `workers` lookup
+    threads, each with its own pooled searcher. The next batch is collected while
+    they run, a slow chunk only holds up its own lookup thread.
+    """
+
+    def __init__(self, window=0.005, max_batch=32, mode=None, workers=4):
+        self._window = window
+        self._max_batch = max_batch
+        self._mode = mode
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='lookup-batcher', daemon=True)
+        self._workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lookup-worker')
+        self._idle = threading.BoundedSemaphore(workers)  # lookup threads free for the next chunk
+        self.batch_sizes = Histogram(BATCH_SIZE_BOUNDS)
+        self.lookup_latency = Histogram()
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, chunk):
+        future = Future()
+        self._queue.put((chunk, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self._window
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _lookup(self, chunk, futures):
+        started = time.time()
+        try:
+            attributes = lookup_attributes(chunk, mode=self._mode)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for future in futures:
+                future.set_result(list(attributes))
+        finally:
+            self._idle.release()
+        self.lookup_latency.observe(time.time() - started)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            self.batch_sizes.observe(len(batch))
+            futures = {}
+            for chunk, future in batch:
+                futures.setdefault(chunk, []).append(future)
+            for chunk, chunk_futures in futures.items():
+                # only hand out chunks to free lookup threads, so requests arriving
+                # while all of them are busy are batched together
+                self._idle.acquire()
+                try:
+                    self._workers.submit(self._lookup, chunk, chunk_futures)
+                except RuntimeError:
+                    # the lookup threads are shut down when the interpreter exits
+                    return
+
+
+class LookupHandler(BaseHTTPRequestHandler):
+    server_version = 'MagiaLookup/1.0'
+
+    def log_message(self, format, *args):
+        logging.getLogger('lookup_attributes.server').debug(format, *args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/metrics':
+            self._send_json(200, self.server.metrics())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/lookup':
+            self._send_json(404, {'error': 'not found'})
+            return
+        started = time.time()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if 'chunks' in request:
+                chunks = [str(c) for c in request['chunks']]
+            else:
+                chunks = [str(request['chunk'])]
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'error': 'expected {"chunk": "..."} or {"chunks": [...]}'})
+            return
+        futures = [self.server.batcher.submit(chunk) for chunk in chunks]
+        # one deadline for all chunks of the request
+        if wait(futures, timeout=self.server.timeout).not_done:
+            self._send_json(504, {'error': 'lookup timed out'})
+            return
+        try:
+            results = [f.result() for f in futures]
+        except Exception as e:
+            self._send_json(500, {'error': str(e) or type(e).__name__})
+            return
+        if 'chunks' in request:
+            self._send_json(200, {'results': results})
+        else:
+            self._send_json(200, {'attributes': results[0]})
+        self.server.request_latency.observe(time.time() - started)
+
+
+class LookupServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, batcher, timeout=30.0):
+        ThreadingHTTPServer.__init__(self, address, LookupHandler)
+        self.batcher = batcher
+        self.timeout = timeout
+        self.request_latency = Histogram()
+
+    def metrics(self):
+        magia_search = get_magia_search()
+        return dict(request_latency=self.request_latency.snapshot(),
+                    lookup_latency=self.batcher.lookup_latency.snapshot(),
+                    batch_size=self.batcher.batch_sizes.snapshot(),
+                    result_cache=magia_search.result_cache.stats(),
+                    searcher_opens=magia_search.searcher_pool.opens,
+                    instrumentation=instrumentation.snapshot() if config.INSTRUMENTATION else None)
+
+
+def make_server(host='127.0.0.1', port=8000, window=0.005, max_batch=32, mode=None, timeout=30.0, workers=4):
+    """
+    Open the index, start the batcher and return a LookupServer ready for serve_forever()
+    """
+    get_magia_search()
+    batcher = MicroBatcher(window=window, max_batch=max_batch, mode=mode, workers=workers)
+    batcher.start()
+    return LookupServer((host, port), batcher, timeout=timeout)
+
+
+def main(host: ("Address to bind", 'option', 'H')='127.0.0.1',
+         port: ("Port to listen on", 'option', 'p', int)=8000,
+         window: ("Batching window in milliseconds", 'option', 'w', float)=5.0,
+         max_batch: ("Maximum chunks per batch", 'option', 'n', int)=32,
+         workers: ("Lookup threads running the chunks of a batch", 'option', 't', int)=4,
+         mode: ("Extraction mode: iterative or single_pass", 'option', 'm')=None,
+         build: ("Build the index, or its shards with config.SHARD_BY, if missing and the side structures it lacks",
+                 'flag', 'b')=False,
+         stages: ("Report per-stage lookup timings in /metrics", 'flag', 'i')=False):
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if stages:
+        config.INSTRUMENTATION = True
+    open_indexes(config.INDEXDIR_PATH, build=build)
+    server = make_server(host, port, window=window / 1000.0, max_batch=max_batch, mode=mode,
+                         workers=workers)
+    print('Serving lookup_attributes on http://{}:{}'.format(*server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import plac
+
+    plac.call(main)
@@ -0,0 +1,27 @@
+from benchmark import expected_values, is_correct
+from lookup_attributes.search import extract_expected
+
+# the "Expected Slot" of the first test_data.csv row
+FRUITY_SMOKY_SYRAH = ('{"intent":"find-product","response":{"entity":{"attributes":['
+                      '{"code":"characteristics","relation":"$in","value":["Fruity","Smoky"]},'
+                      '{"code":"varietals","value":"Syrah"},'
+                      '{"code":"price","relation":"$between","value":["20.0","30.0"]},'
+                      '{"code":"tannin","relation":"$low-minus"}]}}}')
+
+
+def test_list_valued_row_is_flattened():
+    expected = extract_expected(FRUITY_SMOKY_SYRAH)
+    assert expected_values(expected) == ['Fruity', 'Smoky', 'Syrah', '20.0', '30.0']
+    assert is_correct(['syrah', 'fruity', '30.0', 'smoky', '20.0'], expected)
+    assert not is_correct(['syrah', 'fruity'], expected)
+
+
+def test_json_list_strings_are_flattened():
+    assert expected_values(['["Smoke", "Cherry"]', 'Oak']) == ['Smoke', 'Cherry', 'Oak']
+    assert is_correct(['oak', 'cherry', 'smoke'], ['["Smoke", "Cherry"]', 'Oak'])
+
+
+def test_plain_values():
+    assert is_correct(['red', 'chateau latour'], ['chateau latour', 'red'])
+    assert is_correct([], [])
+    assert not is_correct(['red'], [])
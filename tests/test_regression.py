@@ -0,0 +1,73 @@
+"""
+Regression set lookups against the index at config.INDEXDIR_PATH, skipped until
+it is built with python main.py -b
+"""
+import threading
+
+import pytest
+import whoosh.index as index
+
+import config
+from data import REGRESSION_SET
+from lookup_attributes import lookup_attributes, get_magia_search
+from lookup_attributes.search import ITERATIVE, SINGLE_PASS
+
+pytestmark = pytest.mark.skipif(not index.exists_in(config.INDEXDIR_PATH),
+                                reason='no index in {}, build it with python main.py -b'.format(config.INDEXDIR_PATH))
+
+# a lookup running longer than this is taken for a hang, e.g. in Whoosh's block quality skipping
+TIMEOUT = 60
+
+# single-pass picks every attribute from the first ranking while iterative searches again
+# without the consumed tokens, which re-ranks the hits; on some indexes these chunks differ
+SINGLE_PASS_DIFFERENCES = {"red chateau lator", "how are yoou", "chateau lator"}
+
+CHUNKS = sorted({chunk for chunk, expected in REGRESSION_SET})
+
+
+def lookup(chunk, **kwargs):
+    """
+    Return the sorted attributes of a chunk, failing instead of hanging
+    """
+    outcome = []
+
+    def run():
+        try:
+            outcome.append(sorted(lookup_attributes(chunk, **kwargs)))
+        except Exception as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    assert outcome, '{!r} did not return within {}s'.format(chunk, TIMEOUT)
+    if isinstance(outcome[0], Exception):
+        raise outcome[0]
+    return outcome[0]
+
+
+@pytest.mark.parametrize('chunk', CHUNKS)
+def test_single_pass(chunk):
+    single_pass = lookup(chunk, mode=SINGLE_PASS)
+    if chunk not in SINGLE_PASS_DIFFERENCES:
+        assert single_pass == lookup(chunk, mode=ITERATIVE)
+
+
+# the planner's narrowed escalation can settle for a different hit than the full query
+PLANNER_DIFFERENCES = {"chateu meru lator"}
+
+
+@pytest.mark.parametrize('chunk', CHUNKS)
+def test_query_planner(chunk, monkeypatch):
+    # results are cached by tokens only, drop the ones searched without the planner
+    result_cache = get_magia_search().result_cache
+    result_cache.clear()
+    iterative = lookup(chunk, mode=ITERATIVE)
+    result_cache.clear()
+    monkeypatch.setattr(config, 'QUERY_PLANNER', True)
+    try:
+        planned = lookup(chunk, mode=ITERATIVE)
+    finally:
+        result_cache.clear()
+    if chunk not in PLANNER_DIFFERENCES:
+        assert planned == iterative
@@ -0,0 +1,45 @@
+import random
+
+import pytest
+
+from lookup_attributes import rescoring
+
+numpy = pytest.importorskip('numpy')
+
+
+def python_penalties(weights_list, matched_list):
+    return [sum(weight for token, weight in weights if token not in matched)
+            for weights, matched in zip(weights_list, matched_list)]
+
+
+def random_hits(count, seed=0):
+    rng = random.Random(seed)
+    vocabulary = ['token{}'.format(i) for i in range(200)]
+    weights_list = [tuple((rng.choice(vocabulary), rng.uniform(0.0, 12.0)) for _ in range(rng.randint(0, 6)))
+                    for _ in range(count)]
+    matched_list = [{token for token, _ in weights if rng.random() < 0.5} for weights in weights_list]
+    return weights_list, matched_list
+
+
+@pytest.mark.parametrize('count', [0, 1, 32, 300])
+def test_numpy_penalties_match_python(count):
+    weights_list, matched_list = random_hits(count)
+    assert rescoring._unmatched_penalties_numpy(weights_list, matched_list) == \
+        python_penalties(weights_list, matched_list)
+
+
+def test_unmatched_penalties_uses_numpy_from_min_hits(monkeypatch):
+    weights_list, matched_list = random_hits(40, seed=1)
+    calls = []
+    numpy_penalties = rescoring._unmatched_penalties_numpy
+    monkeypatch.setattr(rescoring, '_unmatched_penalties_numpy',
+                        lambda *args: calls.append(len(args[0])) or numpy_penalties(*args))
+    monkeypatch.setattr(rescoring.config, 'VECTORIZE_MIN_HITS', 41)
+    assert rescoring.unmatched_penalties(weights_list, matched_list) == python_penalties(weights_list, matched_list)
+    monkeypatch.setattr(rescoring.config, 'VECTORIZE_MIN_HITS', 40)
+    assert rescoring.unmatched_penalties(weights_list, matched_list) == python_penalties(weights_list, matched_list)
+    assert calls == [40]
+
+
+def test_rescore_subtracts_penalties():
+    assert rescoring.rescore([10.0, 5.0], [(('a', 1.5), ('b', 2.0)), (('c', 1.0),)], [{'a'}, set()]) == [8.0, 4.0]